@@ -0,0 +1,110 @@
+""" A local stand-in for subtensor serving only what the registration path uses, with a configurable block time and
+    difficulty. Blocks get random hashes, register extrinsics are checked with the real proof of work rule and land
+    in the next block, and every call is counted so pollers can be compared.
+
+    python3 bench/chain.py --port 9944 --block_time 2 --difficulty 1000000
+"""
+import os
+import json
+import time
+import hashlib
+import argparse
+import threading
+import http.server
+
+LIMIT = 2 ** 256 - 1
+# Solutions for blocks older than this are rejected, as on the chain.
+MAX_BLOCK_AGE = 3
+
+class MockChain:
+    def __init__( self, block_time: float, difficulty: int ):
+        self.block_time = block_time
+        self.difficulty = difficulty
+        self.lock = threading.Condition()
+        self.reset()
+        threading.Thread( target = self._produce, daemon = True ).start()
+
+    def reset( self ):
+        with self.lock:
+            self.block = 1
+            self.hashes = { 1: '0x' + os.urandom( 32 ).hex() }
+            self.neurons = {}
+            self.queued = {}
+            self.calls = {}
+
+    def _produce( self ):
+        while True:
+            time.sleep( self.block_time )
+            with self.lock:
+                self.block += 1
+                self.hashes[ self.block ] = '0x' + os.urandom( 32 ).hex()
+                self.hashes.pop( self.block - 256, None )
+                for hotkey, coldkey in self.queued.items():
+                    self.neurons.setdefault( hotkey, { 'uid': len( self.neurons ), 'hotkey': hotkey, 'coldkey': coldkey, 'block': self.block, 'time': time.time() } )
+                self.queued = {}
+                self.lock.notify_all()
+
+    def _neuron( self, hotkey: str ) -> dict:
+        return self.neurons.get( hotkey, { 'uid': -1, 'hotkey': hotkey, 'coldkey': None, 'block': None, 'time': None } )
+
+    def call( self, method: str, params: dict ):
+        with self.lock:
+            self.calls[ method ] = self.calls.get( method, 0 ) + 1
+            if method == 'block': return self.block
+            if method == 'difficulty': return self.difficulty
+            if method == 'block_hash': return self.hashes.get( params['block'] )
+            if method == 'neuron': return self._neuron( params['hotkey'] )
+            if method == 'neurons': return list( self.neurons.values() )
+            if method == 'register': return self._register( **params )
+            # Harness controls, counted separately from the calls of the code under test.
+            if method == 'force_register':
+                self.queued[ params['hotkey'] ] = params.get( 'coldkey' )
+                return self.block + 1
+            if method == 'stats': return { 'block': self.block, 'calls': { name: count for name, count in self.calls.items() if name not in ( 'stats', 'force_register' ) }, 'neurons': self.neurons }
+            if method == 'reset': self.reset(); return True
+            raise ValueError( 'Unknown method {}'.format( method ) )
+
+    def _register( self, block_number: int, nonce: int, work: list, hotkey: str, coldkey: str ) -> dict:
+        """ Checks the seal like the chain does and waits for the block including it. Called with the lock held. """
+        if hotkey in self.neurons or hotkey in self.queued: return { 'success': False, 'error': 'AlreadyRegistered' }
+        if block_number not in self.hashes or block_number < self.block - MAX_BLOCK_AGE: return { 'success': False, 'error': 'InvalidWorkBlock' }
+        seal = hashlib.sha256( nonce.to_bytes( 8, 'little' ) + bytes.fromhex( self.hashes[ block_number ][2:] ) ).digest()
+        if list( seal ) != work: return { 'success': False, 'error': 'InvalidSeal' }
+        # The chain rejects a seal whose product with the difficulty overflows 256 bits.
+        if int.from_bytes( seal, 'big' ) * self.difficulty > LIMIT: return { 'success': False, 'error': 'InvalidDifficulty' }
+        self.queued[ hotkey ] = coldkey
+        self.lock.wait_for( lambda: hotkey in self.neurons )
+        return { 'success': True, 'error': None }
+
+def serve( chain: MockChain, port: int ) -> http.server.ThreadingHTTPServer:
+    class Handler( http.server.BaseHTTPRequestHandler ):
+        def do_POST( self ):
+            request = json.loads( self.rfile.read( int( self.headers['Content-Length'] ) ) )
+            try: body = { 'result': chain.call( request['method'], request.get( 'params', {} ) ) }
+            except Exception as e: body = { 'error': str( e ) }
+            payload = json.dumps( body ).encode()
+            self.send_response( 200 )
+            self.send_header( 'Content-Type', 'application/json' )
+            self.send_header( 'Content-Length', str( len( payload ) ) )
+            self.end_headers()
+            self.wfile.write( payload )
+
+        def log_message( self, *args ): pass
+
+    server = http.server.ThreadingHTTPServer( ( '127.0.0.1', port ), Handler )
+    server.daemon_threads = True
+    return server
+
+def main():
+    parser = argparse.ArgumentParser( description = 'Runs a mock subtensor for registration benchmarks.' )
+    parser.add_argument( '--port', type = int, default = 9944, help = 'Port to serve on.' )
+    parser.add_argument( '--block_time', type = float, default = 2, help = 'Seconds between blocks.' )
+    parser.add_argument( '--difficulty', type = int, default = 1000000, help = 'Registration difficulty, the expected number of hashes per solution.' )
+    args = parser.parse_args()
+    server = serve( MockChain( args.block_time, args.difficulty ), args.port )
+    print( 'Mock chain on 127.0.0.1:{} with {}s blocks at difficulty {}'.format( args.port, args.block_time, args.difficulty ), flush = True )
+    try: server.serve_forever()
+    except KeyboardInterrupt: pass
+
+if __name__ == "__main__":
+    main()
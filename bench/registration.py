@@ -0,0 +1,187 @@
+""" Registration benchmarks against the mock chain in bench/chain.py, using the stub bittensor in bench/stub.
+
+    register: runs fast_register.sh (register.py) for each --procs value and measures the time to register, how long
+              the pool takes to notice the registration landed and stop, its hashrate, CPU seconds and chain calls.
+    watch:    runs the fast_register polling loop for --hosts hosts with each of --strategies, registers the hotkeys at
+              random moments and measures detection latency, controller CPU seconds and chain calls.
+              watcher is utils.RegistrationWatcher (needs the marius requirements installed), poll is one loop per
+              host looking up its hotkey every --poll seconds.
+
+    python3 bench/registration.py --benchmarks register watch --procs 1 2 4 --runs 3 --block_time 2 --output bench.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import socket
+import argparse
+import platform
+import resource
+import tempfile
+import threading
+import subprocess
+import statistics
+
+REPO = os.path.dirname( os.path.dirname( os.path.abspath( __file__ ) ) )
+STUB = os.path.join( REPO, 'bench', 'stub' )
+sys.path.insert( 0, STUB )
+import bittensor
+
+class Chain:
+    """ bench/chain.py in a subprocess, so its CPU is not counted against the code under test. """
+    def __init__( self, block_time: float, difficulty: int ):
+        with socket.socket() as s:
+            s.bind( ( '127.0.0.1', 0 ) )
+            self.port = s.getsockname()[1]
+        self.url = 'http://127.0.0.1:{}'.format( self.port )
+        self.block_time = block_time
+        self.process = subprocess.Popen( [ sys.executable, os.path.join( REPO, 'bench', 'chain.py' ), '--port', str( self.port ), '--block_time', str( block_time ), '--difficulty', str( difficulty ) ], stdout = subprocess.DEVNULL )
+        bittensor.MOCK_CHAIN = self.url
+        for _ in range( 100 ):
+            try: self.rpc( 'block' ); break
+            except OSError: time.sleep( 0.1 )
+
+    def rpc( self, method: str, **params ):
+        return bittensor.rpc( method, **params )
+
+    def env( self, home: str ) -> dict:
+        return dict( os.environ, PYTHONPATH = STUB, MOCK_CHAIN = self.url, MOCK_BLOCK_TIME = str( self.block_time ), HOME = home )
+
+    def stop( self ):
+        self.process.terminate()
+        self.process.wait()
+
+def cpu_children() -> float:
+    usage = resource.getrusage( resource.RUSAGE_CHILDREN )
+    return usage.ru_utime + usage.ru_stime
+
+def calls( stats: dict ) -> int:
+    return sum( stats['calls'].values() )
+
+def read_progress( home: str ) -> dict:
+    """ The last line register.py wrote under home, None if it never started hashing. """
+    path = os.path.join( home, '.marius', 'register.jsonl' )
+    if not os.path.exists( path ): return None
+    with open( path ) as f: lines = f.readlines()
+    return json.loads( lines[-1] ) if lines else None
+
+def bench_register( chain: Chain, config, procs: int, run: int ) -> dict:
+    chain.rpc( 'reset' )
+    hotkey = 'register-{}-{}'.format( procs, run )
+    address = bittensor.wallet( name = 'bench', hotkey = hotkey ).hotkey.ss58_address
+    with tempfile.TemporaryDirectory( prefix = 'marius-bench-' ) as home:
+        cpu, start = cpu_children(), time.time()
+        process = subprocess.Popen( [ './fast_register.sh', 'btcli', 'bench', hotkey, str( procs ), str( config.timeout ) ], cwd = REPO, env = chain.env( home ), stdout = subprocess.DEVNULL, stderr = subprocess.DEVNULL )
+        try: process.wait( timeout = config.timeout )
+        except subprocess.TimeoutExpired: process.terminate(); process.wait()
+        end = time.time()
+        stats = chain.rpc( 'stats' )
+        neuron = stats['neurons'].get( address )
+        progress = read_progress( home )
+    return {
+        'procs': progress['procs'] if progress else procs,
+        'registered': neuron != None,
+        'time_to_register': neuron['time'] - start if neuron else None,
+        'stop_after': end - neuron['time'] if neuron else None,
+        'hashrate': progress['hashrate'] if progress else None,
+        'cpu': cpu_children() - cpu,
+        'calls': calls( stats ),
+    }
+
+def _poll( subtensor, address: str, interval: float, timeout: float ) -> bool:
+    """ One loop per host, as fast_register waited before the shared watcher. """
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if not subtensor.neuron_for_pubkey( address ).is_null: return True
+        time.sleep( interval )
+    return False
+
+def bench_watch( chain: Chain, config, strategy: str, hosts: int, run: int, rng: random.Random ) -> dict:
+    chain.rpc( 'reset' )
+    addresses = [ bittensor.wallet( name = 'bench', hotkey = 'watch-{}-{}'.format( run, i ) ).hotkey.ss58_address for i in range( hosts ) ]
+    if strategy == 'watcher':
+        sys.path.insert( 0, REPO )
+        import utils
+        watcher = utils.RegistrationWatcher( bittensor.subtensor(), chain.block_time )
+        wait = lambda address: watcher.watch( address ).wait( config.timeout )
+    else:
+        wait = lambda address: _poll( bittensor.subtensor(), address, config.poll, config.timeout )
+
+    seen = {}
+    def _host( address ):
+        if wait( address ): seen[ address ] = time.time()
+    cpu = time.process_time()
+    threads = [ threading.Thread( target = _host, args = ( address, ), daemon = True ) for address in addresses ]
+    for thread in threads: thread.start()
+    # Registrations land over a few blocks, like winners across a cluster.
+    for address in rng.sample( addresses, len( addresses ) ):
+        time.sleep( rng.uniform( 0, chain.block_time ) )
+        chain.rpc( 'force_register', hotkey = address )
+    for thread in threads: thread.join( config.timeout )
+    cpu = time.process_time() - cpu
+    stats = chain.rpc( 'stats' )
+    latencies = [ seen[ address ] - stats['neurons'][ address ]['time'] for address in addresses if address in seen ]
+    return {
+        'strategy': strategy,
+        'hosts': hosts,
+        'detected': len( latencies ),
+        'latency': statistics.mean( latencies ) if latencies else None,
+        'latency_max': max( latencies ) if latencies else None,
+        'cpu': cpu,
+        'calls': calls( stats ),
+        'calls_per_block': calls( stats ) / max( 1, stats['block'] - 1 ),
+    }
+
+def summarize( title: str, results: list, key: str, columns: list ):
+    """ Prints the mean of each column over the runs of each key value. """
+    print( '\n' + title )
+    print( '  '.join( [ '{:>16}'.format( name ) for name in [ key, 'runs' ] + columns ] ) )
+    for value in sorted( set( result[ key ] for result in results ), key = str ):
+        runs = [ result for result in results if result[ key ] == value ]
+        row = [ str( value ), str( len( runs ) ) ]
+        for column in columns:
+            values = [ float( run[ column ] ) for run in runs if run[ column ] != None ]
+            row.append( '{:.3f}'.format( statistics.mean( values ) ) if values else '-' )
+        print( '  '.join( [ '{:>16}'.format( cell ) for cell in row ] ) )
+
+def main():
+    parser = argparse.ArgumentParser( description = 'Benchmarks the registration path against a local mock chain.' )
+    parser.add_argument( '--benchmarks', type = str, nargs = '*', choices = [ 'register', 'watch' ], default = [ 'register', 'watch' ], help = 'Benchmarks to run.' )
+    parser.add_argument( '--block_time', type = float, default = 2, help = 'Mock chain seconds between blocks.' )
+    parser.add_argument( '--difficulty', type = int, default = 1000000, help = 'Mock chain registration difficulty.' )
+    parser.add_argument( '--procs', type = int, nargs = '*', default = [ 1, 2, 4 ], help = 'register: proof of work processes to compare, -1 for one per core.' )
+    parser.add_argument( '--hosts', type = int, nargs = '*', default = [ 1, 16, 64 ], help = 'watch: hosts waiting for their hotkey.' )
+    parser.add_argument( '--strategies', type = str, nargs = '*', choices = [ 'watcher', 'poll' ], default = [ 'watcher', 'poll' ], help = 'watch: polling strategies to compare.' )
+    parser.add_argument( '--poll', type = float, default = 1, help = 'watch: seconds between lookups of the poll strategy.' )
+    parser.add_argument( '--runs', type = int, default = 3, help = 'Runs of each configuration.' )
+    parser.add_argument( '--timeout', type = float, default = 300, help = 'Seconds before a run is given up.' )
+    parser.add_argument( '--seed', type = int, default = 0, help = 'Seed for the registration moments.' )
+    parser.add_argument( '--output', type = str, default = None, help = 'Write the parameters and every run to this json file.' )
+    config = parser.parse_args()
+
+    rng = random.Random( config.seed )
+    chain = Chain( config.block_time, config.difficulty )
+    results = { 'register': [], 'watch': [] }
+    try:
+        for run in range( config.runs ):
+            if 'register' in config.benchmarks:
+                for procs in config.procs: results['register'].append( bench_register( chain, config, procs, run ) )
+            if 'watch' in config.benchmarks:
+                for strategy in config.strategies:
+                    for hosts in config.hosts: results['watch'].append( bench_watch( chain, config, strategy, hosts, run, rng ) )
+    finally:
+        chain.stop()
+
+    print( 'block time {}s, difficulty {}, {} cores, python {}'.format( config.block_time, config.difficulty, os.cpu_count(), platform.python_version() ) )
+    if results['register']: summarize( 'register.py', results['register'], 'procs', [ 'time_to_register', 'stop_after', 'hashrate', 'cpu', 'calls' ] )
+    if results['watch']:
+        for strategy in config.strategies:
+            summarize( 'fast_register {}'.format( strategy ), [ result for result in results['watch'] if result['strategy'] == strategy ], 'hosts', [ 'detected', 'latency', 'latency_max', 'cpu', 'calls', 'calls_per_block' ] )
+
+    if config.output != None:
+        with open( config.output, 'w' ) as f:
+            json.dump( { 'parameters': vars( config ), 'cores': os.cpu_count(), 'python': platform.python_version(), 'results': results }, f, indent = 2 )
+
+if __name__ == "__main__":
+    main()
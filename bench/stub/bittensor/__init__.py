@@ -0,0 +1,77 @@
+""" Just enough of bittensor for register.py and the marius registration watcher to run against the mock
+    chain in bench/chain.py. Put bench/stub on PYTHONPATH and point MOCK_CHAIN at the chain.
+"""
+import os
+import json
+import hashlib
+import urllib.request
+from types import SimpleNamespace
+
+MOCK_CHAIN = os.environ.get( 'MOCK_CHAIN', 'http://127.0.0.1:9944' )
+__blocktime__ = float( os.environ.get( 'MOCK_BLOCK_TIME', 12 ) )
+
+def rpc( method: str, **params ):
+    request = urllib.request.Request( MOCK_CHAIN, data = json.dumps( { 'method': method, 'params': params } ).encode(), headers = { 'Content-Type': 'application/json' } )
+    with urllib.request.urlopen( request ) as response:
+        body = json.loads( response.read() )
+    if 'error' in body: raise ValueError( body['error'] )
+    return body['result']
+
+def _address( *parts ) -> str:
+    return '5' + hashlib.sha256( '/'.join( parts ).encode() ).hexdigest()[:47]
+
+class wallet:
+    def __init__( self, name: str = 'default', hotkey: str = 'default', **kwargs ):
+        self.name = name
+        self.hotkey_str = hotkey
+        self.hotkey = SimpleNamespace( ss58_address = _address( name, hotkey ) )
+        self.coldkeypub = SimpleNamespace( ss58_address = _address( name ) )
+
+    def __str__( self ):
+        return 'wallet({}, {})'.format( self.name, self.hotkey_str )
+
+def _neuron( record: dict ) -> SimpleNamespace:
+    return SimpleNamespace( is_null = record['uid'] < 0, **record )
+
+class _Response:
+    def __init__( self, result: dict ):
+        self.is_success = result['success']
+        self.error_message = result['error']
+
+    def process_events( self ): pass
+
+class _Substrate:
+    def __enter__( self ): return self
+    def __exit__( self, *args ): pass
+
+    def get_block_hash( self, block: int ) -> str:
+        return rpc( 'block_hash', block = block )
+
+    def compose_call( self, call_module: str, call_function: str, call_params: dict ) -> dict:
+        return call_params
+
+    def create_signed_extrinsic( self, call: dict, keypair ) -> dict:
+        return call
+
+    def submit_extrinsic( self, extrinsic: dict, wait_for_inclusion: bool = False ) -> _Response:
+        return _Response( rpc( 'register', **extrinsic ) )
+
+class subtensor:
+    def __init__( self, *args, **kwargs ):
+        self.substrate = _Substrate()
+
+    def get_current_block( self ) -> int:
+        return rpc( 'block' )
+
+    @property
+    def difficulty( self ) -> int:
+        return rpc( 'difficulty' )
+
+    def neuron_for_pubkey( self, ss58_hotkey: str ) -> SimpleNamespace:
+        return _neuron( rpc( 'neuron', hotkey = ss58_hotkey ) )
+
+    def neurons( self ) -> list:
+        return [ _neuron( record ) for record in rpc( 'neurons' ) ]
+
+    def __str__( self ):
+        return 'subtensor({})'.format( MOCK_CHAIN )
@@ -1,7 +1,5 @@
 
 import bittensor
-from tqdm import tqdm
-from concurrent.futures import ThreadPoolExecutor
 from . import utils as utils
 from loguru import logger
 logger = logger.opt(colors=True)
@@ -35,6 +33,14 @@ def add_args(parser):
         action="store",
         help="A list of nodes (hostnames) the selected command should operate on",
     )
+    checkout_parser.add_argument(
+        "-r",
+        "--refresh",
+        dest="refresh",
+        action="store_true",
+        help="""Refetch the droplet inventory instead of using the local cache""",
+        default=False,
+    )
 
 def checkout(config):
     def _checkout(droplet):
@@ -57,30 +63,18 @@ def checkout(config):
             else:
                 logger.success("<blue>{}</blue>: Made bittensor dirs.", name)
 
-            if utils.remove_bittensor_installation(config, connection).failed:
-                logger.error(
-                    "<blue>{}</blue>: Failed to remove previous bittensor installation",
-                    name,
-                )
-                return
-            else:
-                logger.success(
-                    "<blue>{}</blue>: Remove previous bittensor installation", name
-                )
-
-            if utils.git_clone_bittensor(config, connection).failed:
-                logger.error("<blue>{}</blue>: Failed to clone bittensor", name)
-                return
-            else:
-                logger.success("<blue>{}</blue>: Cloned bittensor", name)
-
-            if utils.git_checkout_bittensor(config, connection, branch).failed:
+            sync_result = utils.git_sync_bittensor(config, connection, branch)
+            if sync_result.failed:
                 logger.error(
                     "<blue>{}</blue>: Failed to checkout bittensor branch: {}",
                     name,
                     branch,
                 )
                 return
+            elif sync_result.skipped:
+                logger.success(
+                    "<blue>{}</blue>: Bittensor branch already up to date", name
+                )
             else:
                 logger.success("<blue>{}</blue>: Checked out bittensor branch", name)
 
@@ -102,5 +96,4 @@ def checkout(config):
             connection.close()
 
     droplets = utils.get_machines(config)
-    with ThreadPoolExecutor(max_workers=config.max_threads) as executor:
-        tqdm(executor.map(_checkout, droplets), total=len(droplets))
\ No newline at end of file
+    utils.run_on_machines(config, _checkout, droplets)
\ No newline at end of file
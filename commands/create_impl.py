@@ -1,6 +1,4 @@
 import bittensor
-from tqdm import tqdm
-from concurrent.futures import ThreadPoolExecutor
 from . import utils as utils
 from loguru import logger
 logger = logger.opt(colors=True)
@@ -34,6 +32,14 @@ def add_args(parser):
         action="store",
         help="A list of nodes (hostnames) the selected command should operate on",
     )
+    create_parser.add_argument(
+        "-r",
+        "--refresh",
+        dest="refresh",
+        action="store_true",
+        help="""Refetch the droplet inventory instead of using the local cache""",
+        default=False,
+    )
 
 
 def create(config):
@@ -43,10 +49,14 @@ def create(config):
     if config.names != None:
         to_create = config.names
 
+    creator = utils.DropletCreator(
+        config, [name for name in to_create if name not in existing_droplets]
+    )
+
     def _create(name):
         try:
             if name not in existing_droplets:
-                if not utils.create_droplet(config, name):
+                if creator.create(name) == None:
                     logger.error(
                         "<blue>{}</blue>: Failed to create droplet with name.", name
                     )
@@ -60,6 +70,5 @@ def create(config):
         finally:
             logger.success("<blue>{}</blue>: DONE CREATE", name)
 
-    with ThreadPoolExecutor(max_workers=config.max_threads) as executor:
-        tqdm(executor.map(_create, to_create), total=len(to_create))
+    utils.run_on_machines(config, _create, to_create)
 
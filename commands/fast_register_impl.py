@@ -1,9 +1,6 @@
 import bittensor
-from tqdm import tqdm
-from concurrent.futures import ThreadPoolExecutor
 from . import utils as utils
 import random
-import time
 from loguru import logger
 logger = logger.opt(colors=True)
 
@@ -38,14 +35,22 @@ def add_args(parser):
         action="store",
         help="A list of nodes (hostnames) the selected command should operate on",
     )
+    fast_register_parser.add_argument(
+        "-r",
+        "--refresh",
+        dest="refresh",
+        action="store_true",
+        help="""Refetch the droplet inventory instead of using the local cache""",
+        default=False,
+    )
     fast_register_parser.add_argument(
         "-p",
         "--procs",
         dest="procs",
         type=int,
         required=False,
-        help="A list of nodes (hostnames) the selected command should operate on",
-        default=5,
+        help="Proof of work processes per host, -1 for one per core.",
+        default=-1,
     )
     fast_register_parser.add_argument(
         "-t",
@@ -71,6 +76,9 @@ def add_args(parser):
 
 
 def fast_register(config):
+    # One chain watcher for every host, notifying each worker when its hotkey registers.
+    watcher = utils.RegistrationWatcher(bittensor.subtensor(), bittensor.__blocktime__)
+
     def _do_register(droplet):
         try:
             # Make connection.
@@ -176,20 +184,11 @@ def fast_register(config):
             utils.run_registration_tools(config, connection)
             logger.debug("<blue>{}</blue>: Started fast registration...", name)
 
-            start = time.time()
-            while time.time() - start < config.timeout:
-                sub = bittensor.subtensor()
-                wallet_neuron = sub.neuron_for_pubkey(wallet.hotkey.ss58_address)
-                if not wallet_neuron.is_null:
-                    utils.kill_fast_register(config, connection)
-                    logger.success(
-                        "<blue>{}</blue>: Killed fast register with success.", name
-                    )
-                    break
-                else:
-                    # logger.success('<blue>{}</blue>: Waiting on registration: remaining: {}/{}', name, time.time() - start, config.timeout)
-                    time.sleep(2)
-                    continue
+            if watcher.watch(wallet.hotkey.ss58_address).wait(config.timeout):
+                utils.kill_fast_register(config, connection)
+                logger.success(
+                    "<blue>{}</blue>: Killed fast register with success.", name
+                )
 
         except Exception as e:
             logger.debug(e)
@@ -206,5 +205,4 @@ def fast_register(config):
     if config.workers != -1:
         random.shuffle(droplets)
         droplets = droplets[: min(config.workers, len(droplets))]
-    with ThreadPoolExecutor(max_workers=len(droplets) * 2) as executor:
-        tqdm(executor.map(_do_register, droplets), total=len(droplets))
\ No newline at end of file
+    utils.run_on_machines(config, _do_register, droplets, limit=len(droplets))
\ No newline at end of file
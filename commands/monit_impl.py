@@ -1,9 +1,10 @@
 
+import time
 import bittensor
-import random
+from rich.console import Console
+from rich.live import Live
 from . import utils as utils
 from loguru import logger
-from . import fast_register_impl
 from . import status_impl
 
 logger = logger.opt(colors=True)
@@ -37,88 +38,141 @@ def add_args(parser):
         action="store",
         help="A list of nodes (hostnames) the selected command should operate on",
     )
+    monit_parser.add_argument(
+        "-r",
+        "--refresh",
+        dest="refresh",
+        action="store_true",
+        help="""Refetch the droplet inventory instead of using the local cache""",
+        default=False,
+    )
     monit_parser.add_argument(
         "-p",
         "--procs",
         dest="procs",
         type=int,
         required=False,
-        help="A list of nodes (hostnames) the selected command should operate on",
-        default=5,
-    )
-    monit_parser.add_argument(
-        "-t",
-        "--timeout",
-        dest="timeout",
-        type=int,
-        required=False,
-        help="Default registration timeout.",
-        default=60 * 60 * 2,
+        help="Proof of work processes per host, -1 for one per core.",
+        default=-1,
     )
     monit_parser.add_argument(
-        "-w",
-        "--workers",
-        dest="workers",
+        "-i",
+        "--interval",
+        dest="interval",
         type=int,
         required=False,
-        help="Number of workers to use for registering, -1 for all.",
-        default=-1,
+        help="Seconds between the starts of reconciliation passes.",
+        default=60,
     )
-    bittensor.wallet.add_args(monit_parser)
+
+
+# A running miner which is not active on chain is only restarted if monit has not started it within this many seconds.
+RESTART_GRACE = 10 * 60
+
+
+def reconcile_droplet(config, droplet, record, restarted):
+    """Brings one host in line with its status record: unregistered hosts stop mining and register in the background,
+    registered hosts whose miner is down, or inactive past RESTART_GRACE, are restarted. Returns the action taken.
+    """
+    name = droplet.name
+    if not record["connected"]:
+        logger.error("<blue>{}</blue>: Failed to make connection to droplet", name)
+        return "unreachable"
+    if not record["installed"]:
+        logger.error("<blue>{}</blue>: Bittensor is not installed", name)
+        return "uninstalled"
+    connection = utils.connection_for_machine(config, droplet)
+    try:
+        if not record["registered"]:
+            if record["running"]:
+                utils.stop_script(config, connection)
+            if utils.start_registration(config, connection):
+                logger.success(
+                    "<blue>{}</blue>: Not registered, started registration", name
+                )
+                return "registering"
+            return "waiting"
+
+        inactive = (
+            record["active"] == 0
+            and time.time() - restarted.get(name, 0) > RESTART_GRACE
+        )
+        if not record["running"] or inactive:
+            utils.stop_script(config, connection)
+            utils.start_command(config, connection, name, config.machines[name].command)
+            restarted[name] = time.time()
+            logger.success(
+                "<blue>{}</blue>: Restarted miner ({})",
+                name,
+                "inactive" if record["running"] else "not running",
+            )
+            return "restarted"
+        return "ok"
+    finally:
+        connection.close()
 
 
 def monit(config):
+    """Reconciles the cluster every --interval seconds. Each pass syncs the neurons once, then probes and fixes hosts
+    concurrently (max_concurrency at a time) against that snapshot, so recovering a host waits for the next pass
+    rather than for every host ahead of it.
+    """
     droplets = utils.get_machines(config)
+    subtensor = bittensor.subtensor()
+    restarted = {}
+    passes = 0
+    console = Console()
     while True:
-        status_impl.commands.status(config)
         try:
-            random.shuffle(droplets)
-            with bittensor.__console__.status(
-                ":satellite: Monitoring."
-            ) as console_status:
-                for i, droplet in enumerate(droplets):
-                    console_status.update(
-                        ":satellite: Monitoring. current: {} ({}/{})".format(
-                            droplet.name, i, len(droplets)
-                        )
-                    )
-                    name = droplet.name
-                    logger.debug("<white>{}</white>: Begin Monit", name)
-                    subtensor = bittensor.subtensor()
-                    connection = utils.connection_for_machine(config, droplet)
-                    logger.debug("<white>{}</white>: Made connection", name)
-                    hotkey = utils.get_hotkey(config, connection)
-                    logger.debug("<white>{}</white>: Got hotkey: {}", name, hotkey)
-                    coldkeypub = utils.get_coldkeypub(config, connection)
-                    logger.debug("<white>{}</white>: Got coldkey: {}", name, coldkeypub)
-                    neuron = subtensor.neuron_for_pubkey(hotkey)
-                    logger.debug("<white>{}</white>: Got neuron: {}", name, neuron)
-
-                    if neuron.is_null:
-                        console_status.update(
-                            ":satellite: Monitoring. current: {} ({}/{}). Registering ... ".format(
-                                droplet.name, i, len(droplets)
-                            )
-                        )
-                        utils.stop_script(config, connection)
-                        config.wallet.name = config.machines[droplet.name].coldkey
-                        config.wallet.hotkey = name
-                        fast_register_impl.fast_register(config)
-
-                    if neuron.active == 0 or not utils.is_script_running(
-                        config, connection
-                    ):
-                        console_status.update(
-                            ":satellite: Monitoring. current: {} ({}/{}). Restarting ... ".format(
-                                droplet.name, i, len(droplets)
-                            )
-                        )
-                        utils.stop_script(config, connection)
-                        command = config.machines[name].command
-                        utils.start_command(config, connection, name, command)
-                        logger.debug("<white>{}</white>: Started", name)
+            start = time.time()
+            passes += 1
+            neurons = utils.neurons_by_hotkey(subtensor)
+
+            records = {}
+            started = {}
+            actions = {}
+
+            def reconcile(droplet):
+                started[droplet.name] = time.time()
+                record = utils.status_record(config, droplet, neurons)
+                actions[droplet.name] = reconcile_droplet(
+                    config, droplet, record, restarted
+                )
+                return record
+
+            def add_record(droplet, record):
+                if record != None:
+                    records[droplet.name] = record
+
+            title = "[bold white]Marius monit pass {}".format(passes)
+            with Live(
+                get_renderable=lambda: status_impl.status.table(
+                    dict(records), droplets, dict(started), title=title
+                ),
+                console=console,
+                refresh_per_second=4,
+            ):
+                utils.run_on_machines(
+                    config, reconcile, droplets, on_result=add_record, progress=False
+                )
+            utils.save_snapshot(config, records.values())
+
+            counts = {}
+            for action in actions.values():
+                counts[action] = counts.get(action, 0) + 1
+            logger.info(
+                "Monit pass {} took {:.0f}s: {}",
+                passes,
+                time.time() - start,
+                ", ".join(
+                    "{} {}".format(count, action)
+                    for action, count in sorted(counts.items())
+                ),
+            )
+            time.sleep(max(0, start + config.interval - time.time()))
 
         except KeyboardInterrupt:
             break
         except Exception as e:
-            logger.exception("Monit error: {}", e)
\ No newline at end of file
+            logger.exception("Monit error: {}", e)
+            time.sleep(config.interval)
@@ -1,9 +1,10 @@
 
+import time
 import bittensor
+from types import SimpleNamespace
 from rich.console import Console
 from rich.table import Table
-from tqdm import tqdm
-from concurrent.futures import ThreadPoolExecutor
+from rich.live import Live
 from . import utils as utils
 from loguru import logger
 logger = logger.opt(colors=True)
@@ -41,173 +42,85 @@ class status:
             action="store",
             help="A list of nodes (hostnames) the selected command should operate on",
         )
+        status_parser.add_argument(
+            "-r",
+            "--refresh",
+            dest="refresh",
+            action="store_true",
+            help="""Refetch the droplet inventory instead of using the local cache""",
+            default=False,
+        )
+        status_parser.add_argument(
+            "--cached",
+            dest="cached",
+            action="store_true",
+            help="""Show the last recorded status instead of probing the cluster""",
+            default=False,
+        )
+        status_parser.add_argument(
+            "--since",
+            dest="since",
+            type=str,
+            required=False,
+            help="""Show per host trends over recorded status runs i.e. 24h, 30m or 7d""",
+            default=None,
+        )
 
-    def run(config):
-        total_stake = 0.0
-        total_rank = 0.0
-        total_trust = 0.0
-        total_consensus = 0.0
-        total_incentive = 0.0
-        total_dividends = 0.0
-        total_emission = 0.0
-
-        def get_row(droplet):
-            try:
-                connection = utils.connection_for_machine(config, droplet)
-                can_connect_bool = utils.can_connect(config, connection)
-                subtensor = bittensor.subtensor()
-                connect_str = "[bold green] YES" if can_connect_bool else "[bold red] NO"
-                hotkey_str = "[yellow] None"
-                coldkeypub_str = "[yellow] None"
-                branch_str = "[yellow] None"
-                is_installed_str = "[bold red] No"
-                is_running_str = "[bold red] No"
-                is_registered_str = "[bold red] No"
-                is_running = False
-                installed = False
-                nonlocal total_stake
-                nonlocal total_rank
-                nonlocal total_trust
-                nonlocal total_consensus
-                nonlocal total_incentive
-                nonlocal total_dividends
-                nonlocal total_emission
-                is_registered = False
-                if can_connect_bool:
-                    try:
-                        hotkey = utils.get_hotkey(config, connection)
-                        hotkey_str = hotkey if hotkey != None else "[yellow] None"
-                    except Exception as e:
-                        hotkey_str = "[yellow] None"
-                        logger.error(
-                            "{}: Failed to pull hotkey error = {}", droplet.name, e
-                        )
-                if can_connect_bool:
-                    try:
-                        coldkeypub = utils.get_coldkeypub(config, connection)
-                        coldkeypub_str = (
-                            coldkeypub[0:10] if coldkeypub != None else "[yellow] None"
-                        )
-                    except Exception as e:
-                        logger.error(
-                            "{}: Failed to pull coldkey error = {}", droplet.name, e
-                        )
-                if can_connect_bool:
-                    try:
-                        branch = utils.get_branch(config, connection)
-                        branch_str = branch if branch != None else "[yellow] None"
-                    except Exception as e:
-                        logger.error(
-                            "{}: Failed to pull branch error = {}", droplet.name, e
-                        )
-                if can_connect_bool and branch != None:
-                    try:
-                        installed = utils.is_installed(config, connection)
-                        is_installed_str = (
-                            "[bold green] Yes" if installed else "[bold red] No"
-                        )
-                    except Exception as e:
-                        logger.error(
-                            "{}: Failed to pull install status error = {}", droplet.name, e
-                        )
-                if can_connect_bool and installed:
-                    try:
-                        is_running = utils.is_script_running(config, connection)
-                        is_running_str = (
-                            "[bold green] Yes" if is_running else "[bold red] No"
-                        )
-                    except Exception as e:
-                        logger.error(
-                            "{}: Failed to pull running status: error = {}", droplet.name, e
-                        )
-                try:
-                    neuron = subtensor.neuron_for_pubkey(hotkey_str)
-                    if not neuron.is_null:
-                        is_registered = True
-                        is_registered_str = (
-                            "[bold green] Yes" if is_registered else "[bold red] No"
-                        )
-                except:
-                    pass
-
-                if is_registered:
-                    metrics = [
-                        str(neuron.uid),
-                        "{:.5f}".format(neuron.stake),
-                        "{:.5f}".format(neuron.rank),
-                        "{:.5f}".format(neuron.trust),
-                        "{:.5f}".format(neuron.consensus),
-                        "{:.5f}".format(neuron.incentive),
-                        "{:.5f}".format(neuron.dividends),
-                        "{:.5f}".format(neuron.emission),
-                        str(neuron.last_update),
-                        str(neuron.active),
-                    ]
-                    total_stake += neuron.stake
-                    total_rank += neuron.rank
-                    total_trust += neuron.trust
-                    total_consensus += neuron.consensus
-                    total_incentive += neuron.incentive
-                    total_dividends += neuron.dividends
-                    total_emission += neuron.emission
-                else:
-                    metrics = ["-", "-", "-", "-", "-", "-", "-", "-", "-", "-"]
+    def row(record):
+        if record["registered"]:
+            metrics = [
+                str(record["uid"]),
+                "{:.5f}".format(record["stake"]),
+                "{:.5f}".format(record["rank"]),
+                "{:.5f}".format(record["trust"]),
+                "{:.5f}".format(record["consensus"]),
+                "{:.5f}".format(record["incentive"]),
+                "{:.5f}".format(record["dividends"]),
+                "{:.5f}".format(record["emission"]),
+                str(record["last_update"]),
+                str(record["active"]),
+            ]
+        else:
+            metrics = ["-", "-", "-", "-", "-", "-", "-", "-", "-", "-"]
+        return (
+            [
+                str(record["name"]),
+                str(record["tag"]),
+                str(record["ip"]),
+                str(record["region"]),
+                str(record["size"]),
+                "[bold green] YES" if record["connected"] else "[bold red] NO",
+                record["branch"] if record["branch"] != None else "[yellow] None",
+                "[bold green] Yes" if record["installed"] else "[bold red] No",
+                "[bold green] Yes" if record["registered"] else "[bold red] No",
+                "[bold green] Yes" if record["running"] else "[bold red] No",
+            ]
+            + metrics
+            + [
+                record["coldkeypub"][0:10]
+                if record["coldkeypub"] != None
+                else "[yellow] None",
+                record["hotkey"] if record["hotkey"] != None else "[yellow] None",
+            ]
+        )
 
-                row = (
-                    [
-                        str(droplet.name),
-                        str(droplet.tags[0]),
-                        str(droplet.ip_address),
-                        str(droplet.region["name"]),
-                        str(droplet.size_slug),
-                        str(connect_str),
-                        branch_str,
-                        is_installed_str,
-                        is_registered_str,
-                        is_running_str,
-                    ]
-                    + metrics
-                    + [coldkeypub_str, hotkey_str]
-                )
-                connection.close()
-            except:
-                row = [
-                    str(droplet.name),
-                    "-",
-                    "-",
-                    "-",
-                    "-",
-                    "-",
-                    "-",
-                    "-",
-                    "-",
-                    "-",
-                    "-",
-                    "-",
-                    "-",
-                    "-",
-                    "-",
-                    "-",
-                    "-",
-                    "-",
-                    "-",
-                    "-",
-                ]
-            return row
+    def table(records, droplets=None, started=None, title="[bold white]Marius"):
+        """Builds the status table from records. Droplets without a record yet are shown as pending."""
+        registered = [record for record in records.values() if record["registered"]]
 
-        droplets = utils.get_machines(config)
-        TABLE_DATA = []
-        with ThreadPoolExecutor(max_workers=config.max_threads) as executor:
-            TABLE_DATA = list(tqdm(executor.map(get_row, droplets), total=len(droplets)))
+        def total(field):
+            return "{:.5f}".format(sum([record[field] for record in registered]))
 
-        TABLE_DATA = [row for row in TABLE_DATA if row != None]
-        TABLE_DATA.sort(key=lambda TABLE_DATA: TABLE_DATA[0])
+        if droplets == None:
+            droplets = [SimpleNamespace(name=name) for name in records]
+        if started == None:
+            started = {}
 
         table = Table(show_footer=False)
-        table.title = "[bold white]Marius"
+        table.title = title
         table.add_column(
             "[overline white]Name",
-            str(len(config.machines)),
+            "{}/{}".format(len(records), len(droplets)),
             footer_style="overline white",
             style="white",
         )
@@ -224,62 +137,23 @@ class status:
         table.add_column(
             "[overline white]Uid", footer_style="overline white", style="yellow"
         )
-        table.add_column(
-            "[overline white]Stake",
-            "{:.5f}".format(total_stake),
-            footer_style="overline white",
-            justify="right",
-            style="green",
-            no_wrap=True,
-        )
-        table.add_column(
-            "[overline white]Rank",
-            "{:.5f}".format(total_rank),
-            footer_style="overline white",
-            justify="right",
-            style="green",
-            no_wrap=True,
-        )
-        table.add_column(
-            "[overline white]Trust",
-            "{:.5f}".format(total_trust),
-            footer_style="overline white",
-            justify="right",
-            style="green",
-            no_wrap=True,
-        )
-        table.add_column(
-            "[overline white]Consensus",
-            "{:.5f}".format(total_consensus),
-            footer_style="overline white",
-            justify="right",
-            style="green",
-            no_wrap=True,
-        )
-        table.add_column(
-            "[overline white]Incentive",
-            "{:.5f}".format(total_incentive),
-            footer_style="overline white",
-            justify="right",
-            style="green",
-            no_wrap=True,
-        )
-        table.add_column(
-            "[overline white]Dividends",
-            "{:.5f}".format(total_dividends),
-            footer_style="overline white",
-            justify="right",
-            style="green",
-            no_wrap=True,
-        )
-        table.add_column(
-            "[overline white]Emission",
-            "{:.5f}".format(total_emission),
-            footer_style="overline white",
-            justify="right",
-            style="green",
-            no_wrap=True,
-        )
+        for field in [
+            "Stake",
+            "Rank",
+            "Trust",
+            "Consensus",
+            "Incentive",
+            "Dividends",
+            "Emission",
+        ]:
+            table.add_column(
+                "[overline white]{}".format(field),
+                total(field.lower()),
+                footer_style="overline white",
+                justify="right",
+                style="green",
+                no_wrap=True,
+            )
         table.add_column(
             "[overline white]Lastupdate (blocks)", justify="right", no_wrap=True
         )
@@ -291,10 +165,152 @@ class status:
         table.add_column("[overline white]Hotkey", style="blue", no_wrap=False)
         table.show_footer = True
 
-        for row in TABLE_DATA:
+        for droplet in sorted(droplets, key=lambda droplet: droplet.name):
+            if droplet.name in records:
+                row = status.row(records[droplet.name])
+            else:
+                waiting_str = (
+                    "[yellow] {:.0f}s".format(time.time() - started[droplet.name])
+                    if droplet.name in started
+                    else "[yellow] queued"
+                )
+                row = [
+                    str(droplet.name),
+                    str(droplet.tags[0]),
+                    str(droplet.ip_address),
+                    str(droplet.region["name"]),
+                    str(droplet.size_slug),
+                    waiting_str,
+                ] + ["-"] * 14
             table.add_row(*row)
         table.box = None
         table.pad_edge = False
         table.width = None
+        return table
+
+    def trends(config):
+        snapshots = utils.load_snapshots_since(
+            config, utils.parse_duration(config.since)
+        )
+        hosts = {}
+        for record in snapshots:
+            if config.names == None or record["name"] in config.names:
+                hosts.setdefault(record["name"], []).append(record)
+
+        def percent(samples, field):
+            return "{:.0f}%".format(
+                100 * sum([1 for sample in samples if sample[field]]) / len(samples)
+            )
+
+        table = Table(show_footer=False)
+        table.title = "[bold white]Marius trends over {}".format(config.since)
+        table.add_column(
+            "[overline white]Name",
+            str(len(hosts)),
+            footer_style="overline white",
+            style="white",
+        )
+        table.add_column("[overline white]Samples", justify="right")
+        table.add_column("[overline white]Connected", justify="right", style="green")
+        table.add_column("[overline white]Running", justify="right", style="green")
+        table.add_column("[overline white]Registered", justify="right", style="green")
+        table.add_column("[overline white]Uid", style="yellow")
+        for column in [
+            "Stake",
+            "Stake change",
+            "Rank",
+            "Trust",
+            "Incentive",
+            "Emission (mean)",
+        ]:
+            table.add_column(
+                "[overline white]{}".format(column),
+                justify="right",
+                style="green",
+                no_wrap=True,
+            )
+        table.add_column("[overline white]Probe (mean)", justify="right", no_wrap=True)
+        for name in sorted(hosts):
+            samples = hosts[name]
+            registered = [sample for sample in samples if sample["registered"]]
+            last = registered[-1] if len(registered) > 0 else None
+            table.add_row(
+                name,
+                str(len(samples)),
+                percent(samples, "connected"),
+                percent(samples, "running"),
+                percent(samples, "registered"),
+                str(last["uid"]) if last else "-",
+                "{:.5f}".format(last["stake"]) if last else "-",
+                "{:+.5f}".format(last["stake"] - registered[0]["stake"])
+                if last
+                else "-",
+                "{:.5f}".format(last["rank"]) if last else "-",
+                "{:.5f}".format(last["trust"]) if last else "-",
+                "{:.5f}".format(last["incentive"]) if last else "-",
+                "{:.5f}".format(
+                    sum([sample["emission"] for sample in registered]) / len(registered)
+                )
+                if last
+                else "-",
+                "{:.2f}s".format(
+                    sum([sample["latency"] for sample in samples]) / len(samples)
+                ),
+            )
+        table.box = None
+        table.pad_edge = False
+        table.width = None
+        Console().print(table)
+
+    def run(config):
+        if "since" in config and config.since != None:
+            status.trends(config)
+            return
+
+        if "cached" in config and config.cached:
+            last_run, cached = utils.load_last_snapshot(config)
+            if last_run == None:
+                logger.error(
+                    "No cached status for cluster {}, run marius status first.",
+                    config.cluster,
+                )
+                return
+            records = {
+                record["name"]: record
+                for record in cached
+                if config.names == None or record["name"] in config.names
+            }
+            title = "[bold white]Marius [yellow](cached {:.0f}s ago)".format(
+                time.time() - last_run
+            )
+            Console().print(status.table(records, title=title))
+            return
+
+        droplets = utils.get_machines(config)
+        try:
+            neurons = utils.neurons_by_hotkey(bittensor.subtensor())
+        except Exception as e:
+            logger.error("Failed to sync neurons from chain error = {}", e)
+            neurons = {}
+
+        # Rows are filled in as each host responds, hosts still being probed show their elapsed time.
+        records = {}
+        started = {}
+
+        def start_record(droplet):
+            started[droplet.name] = time.time()
+
+        def add_record(droplet, record):
+            records[droplet.name] = record
+
+        # Live renders from its own thread while the probes fill records and started, so it gets copies.
         console = Console()
-        console.print(table)
\ No newline at end of file
+        with Live(
+            get_renderable=lambda: status.table(dict(records), droplets, dict(started)),
+            console=console,
+            refresh_per_second=4,
+        ):
+            utils.status_records(
+                config, droplets, neurons, on_start=start_record, on_result=add_record
+            )
+        utils.save_snapshot(config, records.values())
@@ -15,58 +15,375 @@
 # OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER 
 # DEALINGS IN THE SOFTWARE.
 
+import io
 import os
 import json
+import shutil
+import subprocess
 import time
+import random
+import heapq
+import shlex
+import hashlib
+import socket
+import atexit
+import threading
+import functools
+import contextlib
+import http.server
+import urllib.request
+import urllib.error
+import sqlite3
+import asyncio
 from types import SimpleNamespace
 import paramiko
+import asyncssh
 import digitalocean
 import fabric
 from patchwork.transfers import rsync
 from fabric import Connection
+from invoke.exceptions import CommandTimedOut
 from loguru import logger
-from torch import detach
+from tqdm import tqdm
+from concurrent.futures import ThreadPoolExecutor
 logger = logger.opt(colors=True)
 
-def get_machines( config ):
-    if 'contabo' not in config:
-        manager = digitalocean.Manager( token = config.token )
-        if config.cluster == 'all':
-            droplets = manager.get_all_droplets()
-        else:
-            droplets = manager.get_all_droplets( tag_name = [ config.cluster ])
-        droplets = [drop for drop in droplets if drop.name in config.machines]
-        if config.names != None:
-            droplets = [drop for drop in droplets if drop.name in config.names]
+# Local state kept by marius on the controller.
+MARIUS_DIR = os.path.expanduser( '~/.marius' )
+
+# Seconds before the cached droplet inventory is considered stale, override with inventory_ttl in the config.
+INVENTORY_TTL = 5 * 60
+INVENTORY_LOCK = threading.Lock()
+_inventory_refreshed = False
+
+def inventory_path( config ) -> str:
+    return os.path.join( MARIUS_DIR, 'inventory', '{}.json'.format( config.cluster ) )
+
+def _droplet_record( droplet ) -> dict:
+    return {
+        'id': droplet.id,
+        'name': droplet.name,
+        'ip_address': droplet.ip_address,
+        'region': { 'name': droplet.region['name'] },
+        'tags': list( droplet.tags ),
+        'size_slug': droplet.size_slug,
+        'status': droplet.status,
+    }
+
+def _droplet_from_record( record ):
+    return SimpleNamespace( **record )
+
+def load_inventory( config ) -> dict:
+    try:
+        with open( inventory_path( config ), 'r' ) as f:
+            return json.load( f )
+    except Exception:
+        return { 'updated': 0, 'droplets': {} }
+
+def save_inventory( config, inventory ):
+    path = inventory_path( config )
+    os.makedirs( os.path.dirname( path ), exist_ok = True )
+    with open( path + '.tmp', 'w' ) as f:
+        json.dump( inventory, f, indent = 2 )
+    os.replace( path + '.tmp', path )
+
+def refresh_inventory( config ) -> dict:
+    manager = digitalocean.Manager( token = config.token )
+    if config.cluster == 'all':
+        droplets = manager.get_all_droplets()
+    else:
+        droplets = manager.get_all_droplets( tag_name = [ config.cluster ])
+    with INVENTORY_LOCK:
+        cached = load_inventory( config )['droplets']
+        fresh = { str( droplet.id ): _droplet_record( droplet ) for droplet in droplets }
+        for droplet_id in fresh.keys() - cached.keys():
+            logger.debug("Inventory: added droplet {}", fresh[ droplet_id ]['name'])
+        for droplet_id in cached.keys() - fresh.keys():
+            logger.debug("Inventory: dropped destroyed droplet {}", cached[ droplet_id ]['name'])
+        inventory = { 'updated': time.time(), 'droplets': fresh }
+        save_inventory( config, inventory )
+    return inventory
+
+def record_droplet( config, droplet ):
+    """ Adds or updates a single droplet in the inventory without refetching the account. """
+    with INVENTORY_LOCK:
+        inventory = load_inventory( config )
+        inventory['droplets'][ str( droplet.id ) ] = _droplet_record( droplet )
+        save_inventory( config, inventory )
+
+def get_inventory( config ) -> dict:
+    """ Returns the cached droplet inventory, refetching it when stale or when --refresh was passed. """
+    global _inventory_refreshed
+    ttl = config.inventory_ttl if 'inventory_ttl' in config else INVENTORY_TTL
+    inventory = load_inventory( config )
+    force = 'refresh' in config and config.refresh and not _inventory_refreshed
+    if force or time.time() - inventory['updated'] > ttl:
+        inventory = refresh_inventory( config )
+        _inventory_refreshed = True
+    return inventory
 
+def static_machines( config ):
+    droplets = []
+    for machine in config.machines:
+        droplet = SimpleNamespace()
+        droplet.name = machine
+        droplet.ip_address = config.machines[machine].ip
+        droplet.region = {'name': 'contabo'}
+        droplet.tags = ['contabo']
+        droplet.size_slug = 'None'
+        droplet.user = config.machines[machine].user
+        droplets.append( droplet )
+    return droplets
+
+def get_machines( config ):
     if 'contabo' in config:
-        droplets = []
-        for machine in config.machines:
-            if config.names == None or machine in config.names:
-                droplet = SimpleNamespace()
-                droplet.name = machine
-                droplet.ip_address = config.machines[machine].ip
-                droplet.region = {'name': 'contabo'}
-                droplet.tags = ['contabo']
-                droplet.size_slug = 'None'
-                droplet.user = config.machines[machine].user
-                droplets.append( droplet )
+        droplets = static_machines( config )
+    else:
+        droplets = [ _droplet_from_record( record ) for record in get_inventory( config )['droplets'].values() ]
+    droplets = [drop for drop in droplets if drop.name in config.machines]
+    if config.names != None:
+        droplets = [drop for drop in droplets if drop.name in config.names]
     return droplets
 
-def connection_for_machine( config, machine ) -> Connection:
-    if 'contabo' not in config:
+def max_concurrency( config ) -> int:
+    return config.max_concurrency if 'max_concurrency' in config else config.max_threads
+
+def run_on_machines( config, fn, machines, on_result = None, limit = None, progress = True ) -> list:
+    """ Runs fn( machine ) for each machine on a pool of at most limit worker threads (max_concurrency by default),
+        so limit hosts are in flight at once with one thread each. on_result( machine, result ) is called from the
+        worker as each host finishes. Returns results in the order of machines, None where fn raised.
+        Pass progress = False when the caller renders its own live view.
+    """
+    machines = list( machines )
+    if len( machines ) == 0:
+        return []
+    limit = max_concurrency( config ) if limit == None else limit
+    results = [ None ] * len( machines )
+    with tqdm( total = len( machines ), disable = not progress ) as progress_bar:
+        def _run( index, machine ):
+            try:
+                results[ index ] = fn( machine )
+            except Exception as e:
+                logger.exception( e )
+            if on_result != None:
+                on_result( machine, results[ index ] )
+            progress_bar.update( 1 )
+
+        with ThreadPoolExecutor( max_workers = max( 1, min( limit, len( machines ) ) ) ) as executor:
+            for index, machine in enumerate( machines ):
+                executor.submit( _run, index, machine )
+    return results
+
+# Seconds between ssh keepalive packets on pooled connections.
+KEEPALIVE_INTERVAL = 30
+
+# Seconds to wait for the tcp connection and for a channel to open, paramiko waits an hour for channels by default.
+CONNECT_TIMEOUT = 20
+CHANNEL_TIMEOUT = 60
+
+# Seconds of remote work a host gets each time its connection is borrowed, override with host_timeout in the config.
+HOST_TIMEOUT = 30 * 60
+# Seconds a provisioning command (apt, pip, wheel builds, docker) may run, override with install_timeout in the config.
+# None waits as long as the command takes, like before the host deadline. Provisioning does not use the host budget.
+INSTALL_TIMEOUT = None
+
+# Transient ssh errors are retried this many times with exponential backoff and full jitter.
+RETRY_ATTEMPTS = 3
+RETRY_BACKOFF = 2.0
+
+# Consecutive failed operations before a host is marked unhealthy and skipped for BREAKER_COOLDOWN seconds.
+BREAKER_THRESHOLD = 3
+BREAKER_COOLDOWN = 5 * 60
+
+# Errors which mean the underlying ssh transport went away rather than the remote command failing.
+CONNECTION_ERRORS = ( EOFError, socket.error, paramiko.SSHException )
+
+class HostUnavailable( Exception ):
+    """ Raised instead of running a command on a host whose deadline passed or whose circuit breaker is open. """
+
+class CircuitBreaker:
+    """ Tracks consecutive failures per host so repeated timeouts on a dead host are only paid once per cooldown. """
+    def __init__( self, threshold = BREAKER_THRESHOLD, cooldown = BREAKER_COOLDOWN ):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = {}
+        self.opened = {}
+        self.lock = threading.Lock()
+
+    def is_open( self, host ) -> bool:
+        with self.lock:
+            if host not in self.opened:
+                return False
+            if time.time() - self.opened[ host ] > self.cooldown:
+                # Half open: let the next operation through, a single failure reopens the breaker.
+                del self.opened[ host ]
+                self.failures[ host ] = self.threshold - 1
+                return False
+            return True
+
+    def record_success( self, host ):
+        with self.lock:
+            self.failures.pop( host, None )
+            self.opened.pop( host, None )
+
+    def record_failure( self, host ):
+        with self.lock:
+            self.failures[ host ] = self.failures.get( host, 0 ) + 1
+            if self.failures[ host ] >= self.threshold and host not in self.opened:
+                logger.warning("<blue>{}</blue>: Marked unhealthy after {} failures, skipping for {}s", host, self.failures[ host ], self.cooldown)
+                self.opened[ host ] = time.time()
+
+BREAKER = CircuitBreaker()
+
+class PooledConnection( Connection ):
+    """ A fabric Connection owned by the process wide connection pool.
+        close() is a no-op so commands can keep closing what they borrow, the pool closes everything on exit.
+        run() enforces the host deadline, retries transient transport errors and feeds the circuit breaker.
+        A command whose channel had opened may already have run, so it is only retried when the caller did not pass
+        idempotent = False.
+        The deadline belongs to the thread which borrowed the connection, so hosts shared by concurrent commands keep
+        separate budgets. Commands with their own timeout (provisioning, registration) are not bound by it and the time
+        they take is added back to it.
+    """
+    # Connection is an invoke DataProxy which stores unknown attributes in its config and copies them, locks can not
+    # be copied. Attributes declared on the class are set on the instance as usual.
+    _open_lock = None
+    _session = None
+
+    def __init__( self, *args, **kwargs ):
+        super().__init__( *args, **kwargs )
+        self._open_lock = threading.Lock()
+        self._session = threading.local()
+
+    def open( self ):
+        with self._open_lock:
+            if self.is_connected:
+                return
+            result = super().open()
+            self.transport.set_keepalive( KEEPALIVE_INTERVAL )
+            self.transport.channel_timeout = CHANNEL_TIMEOUT
+            return result
+
+    def is_healthy( self ) -> bool:
+        if not self.is_connected:
+            return False
         try:
-            key = paramiko.RSAKey.from_private_key_file( os.path.expanduser( config.sshkey ) )
-            con = Connection( machine.ip_address, user='root', connect_kwargs={ "pkey" : key })
-        except:
-            con = Connection( machine.ip_address, user='root', connect_kwargs={ "key_filename" : os.path.expanduser( config.sshkey )})
-    if 'contabo' in config:
+            self.transport.send_ignore()
+            return True
+        except Exception:
+            return False
+
+    @property
+    def deadline( self ) -> float:
+        return getattr( self._session, 'deadline', None )
+
+    @deadline.setter
+    def deadline( self, deadline: float ):
+        self._session.deadline = deadline
+
+    def remaining( self ) -> float:
+        return None if self.deadline == None else self.deadline - time.time()
+
+    def create_session( self ):
+        channel = super().create_session()
+        self._session.opened = True
+        return channel
+
+    def run( self, command, idempotent: bool = True, **kwargs ):
+        if BREAKER.is_open( self.host ):
+            raise HostUnavailable( "{} is marked unhealthy".format( self.host ) )
+        explicit_timeout = 'timeout' in kwargs or kwargs.get( 'disown', False )
+        if explicit_timeout and self.deadline != None:
+            start = time.time()
+            try:
+                return self._run_with_retries( command, idempotent, explicit_timeout, **kwargs )
+            finally:
+                self.deadline += time.time() - start
+        return self._run_with_retries( command, idempotent, explicit_timeout, **kwargs )
+
+    def _run_with_retries( self, command, idempotent: bool, explicit_timeout: bool, **kwargs ):
+        for attempt in range( RETRY_ATTEMPTS ):
+            self._session.opened = False
+            # Commands which set their own timeout (i.e. registration) are not bound by the host deadline.
+            if not explicit_timeout and self.deadline != None:
+                if self.remaining() <= 0:
+                    BREAKER.record_failure( self.host )
+                    raise HostUnavailable( "{} ran out of its deadline".format( self.host ) )
+                kwargs['timeout'] = self.remaining()
+            try:
+                result = super().run( command, **kwargs )
+                BREAKER.record_success( self.host )
+                return result
+            except paramiko.AuthenticationException:
+                BREAKER.record_failure( self.host )
+                raise
+            except CommandTimedOut:
+                # The host answered, the command just outlived its timeout (i.e. a registration that did not win).
+                raise
+            except CONNECTION_ERRORS as e:
+                self.discard()
+                delay = random.uniform( 0, RETRY_BACKOFF * 2 ** attempt )
+                out_of_time = self.deadline != None and not explicit_timeout and self.remaining() < delay
+                may_have_run = self._session.opened and not idempotent
+                if attempt == RETRY_ATTEMPTS - 1 or out_of_time or may_have_run:
+                    BREAKER.record_failure( self.host )
+                    raise
+                logger.debug("{}: Retrying in {:.1f}s after: {}", self.host, delay, e)
+                time.sleep( delay )
+
+    def close( self ):
+        pass
+
+    def discard( self ):
+        super().close()
+        self._sftp = None
+
+CONNECTION_POOL = {}
+CONNECTION_POOL_LOCK = threading.Lock()
+
+def close_all_connections():
+    with CONNECTION_POOL_LOCK:
+        for con in CONNECTION_POOL.values():
+            con.discard()
+        CONNECTION_POOL.clear()
+atexit.register( close_all_connections )
+
+# Private key types marius can authenticate with, tried in this order.
+KEY_TYPES = ( paramiko.RSAKey, paramiko.Ed25519Key, paramiko.ECDSAKey )
+
+@functools.lru_cache( maxsize = None )
+def load_private_key( path: str ) -> paramiko.PKey:
+    """ Parses and type-detects the ssh key once per process, every connection shares the result. """
+    errors = []
+    for key_type in KEY_TYPES:
         try:
-            key = paramiko.RSAKey.from_private_key_file( os.path.expanduser( config.sshkey ) )
-            con = Connection( machine.ip_address, user = machine.user, connect_kwargs={ "pkey" : key })
-        except:
-            con = Connection( machine.ip_address, user = machine.user, connect_kwargs={ "key_filename" : os.path.expanduser( config.sshkey )})
+            return key_type.from_private_key_file( path )
+        except paramiko.SSHException as e:
+            errors.append( '{}: {}'.format( key_type.__name__, e ) )
+    raise ValueError( "Could not load ssh key {} as RSA, Ed25519 or ECDSA ({})".format( path, ', '.join( errors ) ) )
+
+def _new_connection( config, host, user ) -> PooledConnection:
+    key = load_private_key( os.path.expanduser( config.sshkey ) )
+    # Relaying artifacts between hosts authenticates with the controller's forwarded ssh agent.
+    forward_agent = 'fanout' in config and config.fanout > 0
+    return PooledConnection( host, user = user, forward_agent = forward_agent, connect_timeout = CONNECT_TIMEOUT, connect_kwargs={ "pkey" : key, "look_for_keys": False })
+
+def connection_for_machine( config, machine ) -> Connection:
+    user = machine.user if 'contabo' in config else 'root'
+    pool_key = ( machine.ip_address, user, os.path.expanduser( config.sshkey ) )
+    with CONNECTION_POOL_LOCK:
+        con = CONNECTION_POOL.get( pool_key )
+        if con == None:
+            con = _new_connection( config, machine.ip_address, user )
+            CONNECTION_POOL[ pool_key ] = con
 
+    # Each borrow starts a fresh operation budget for the host in the borrowing thread.
+    con.deadline = time.time() + ( config.host_timeout if 'host_timeout' in config else HOST_TIMEOUT )
+
+    # Drop stale sessions here, the next run reopens the connection.
+    if con.is_connected and not con.is_healthy():
+        logger.debug("{}: Dropping unhealthy pooled connection", machine.ip_address)
+        con.discard()
     return con
 
 def can_connect( config, connection ) -> bool:
@@ -76,85 +393,671 @@ def can_connect( config, connection ) -> bool:
     except:
         return False
 
-def create_droplet( config, name ) -> bool:
-    client = digitalocean.Manager( token = config.token ) 
+# Hosts the asyncio runner keeps in flight at once, override with max_inflight in the config. Each in-flight host costs
+# one ssh connection and a coroutine, not a thread.
+MAX_INFLIGHT = 1000
+# Bytes of output the asyncio runner keeps per command, the rest is read and dropped so memory stays bounded.
+OUTPUT_LIMIT = 64 * 1024
+SSH_PORT = 22
+
+def max_inflight( config ) -> int:
+    return config.max_inflight if 'max_inflight' in config else MAX_INFLIGHT
+
+@functools.lru_cache( maxsize = None )
+def load_async_key( path: str ) -> asyncssh.SSHKey:
+    return asyncssh.read_private_key( path )
+
+async def _connect_async( config, machine ) -> asyncssh.SSHClientConnection:
+    """ Opens an asyncssh connection, retrying transport errors like PooledConnection.run. Authentication errors are not retried. """
+    user = machine.user if 'contabo' in config else 'root'
+    key = load_async_key( os.path.expanduser( config.sshkey ) )
+    for attempt in range( RETRY_ATTEMPTS ):
+        try:
+            return await asyncio.wait_for( asyncssh.connect( machine.ip_address, port = SSH_PORT, username = user, client_keys = [ key ], known_hosts = None, agent_path = None, keepalive_interval = KEEPALIVE_INTERVAL ), CONNECT_TIMEOUT )
+        except asyncssh.PermissionDenied:
+            raise
+        except ( OSError, asyncssh.Error, asyncio.TimeoutError ) as e:
+            if attempt == RETRY_ATTEMPTS - 1:
+                raise
+            delay = random.uniform( 0, RETRY_BACKOFF * 2 ** attempt )
+            logger.debug("{}: Retrying in {:.1f}s after: {}", machine.ip_address, delay, e)
+            await asyncio.sleep( delay )
+
+async def _run_command_async( connection, command: str ) -> SimpleNamespace:
+    chunks, size = [], 0
+    async with connection.create_process( command, stderr = asyncssh.DEVNULL ) as process:
+        while True:
+            chunk = await process.stdout.read( OUTPUT_LIMIT )
+            if not chunk:
+                break
+            if size < OUTPUT_LIMIT:
+                chunks.append( chunk[ :OUTPUT_LIMIT - size ] )
+                size += len( chunks[-1] )
+        await process.wait()
+    # The exit status is None when the command was killed by a signal or the connection went away.
+    exited = process.exit_status if process.exit_status != None else -1
+    return SimpleNamespace( stdout = ''.join( chunks ), exited = exited, ok = exited == 0, failed = exited != 0 )
+
+async def _run_steps_async( config, machine, steps ) -> dict:
+    """ Runs each ( step, command, required ) in order over one connection. A required step which fails stops the host,
+        a step which is not required (i.e. stopping a miner which may not be running) only logs.
+        Returns { step: result } for the steps which ran, result has stdout, exited, ok and failed like a fabric Result.
+    """
+    name = machine.name
+    connection = await _connect_async( config, machine )
+    results = {}
+    try:
+        for step, command, required in steps:
+            logger.debug("{}: Running {}: {}", name, step, command)
+            results[ step ] = await _run_command_async( connection, command )
+            if results[ step ].ok: logger.debug('<blue>{}</blue>: {} done', name, step)
+            elif required: logger.error('<blue>{}</blue>: {} failed with exit code {}', name, step, results[ step ].exited); break
+            else: logger.debug('<blue>{}</blue>: {} failed with exit code {}', name, step, results[ step ].exited)
+    finally:
+        connection.close()
+    return results
+
+def run_commands_on_machines( config, machines, steps, on_start = None, on_result = None, progress = True ) -> list:
+    """ Runs the shell command steps on every machine from one asyncio event loop, up to max_inflight hosts at once.
+        steps is a list of ( step, command, required ) or a function of the machine returning one. A fixed set of
+        max_inflight worker coroutines pulls hosts off the list, so memory is bounded by the limit and not the cluster size.
+        Hosts get host_timeout seconds and are skipped while their circuit breaker is open, like PooledConnection.
+        on_start( machine ) and on_result( machine, result ) are called from the event loop thread.
+        Returns the { step: result } of each machine in order, None where the host could not be reached.
+        Commands which need file transfers or fabric Results stay on run_on_machines.
+    """
+    machines = list( machines )
+    if len( machines ) == 0:
+        return []
+    timeout = config.host_timeout if 'host_timeout' in config else HOST_TIMEOUT
+    results = [ None ] * len( machines )
+    pending = iter( enumerate( machines ) )
+
+    async def _host( machine ):
+        if BREAKER.is_open( machine.ip_address ):
+            logger.error('<blue>{}</blue>: Skipped, host is marked unhealthy', machine.name); return None
+        try:
+            result = await asyncio.wait_for( _run_steps_async( config, machine, steps( machine ) if callable( steps ) else steps ), timeout )
+        except ( OSError, asyncssh.Error, asyncio.TimeoutError ) as e:
+            BREAKER.record_failure( machine.ip_address )
+            logger.error('<blue>{}</blue>: Failed to make connection to droplet error = {!r}', machine.name, e); return None
+        BREAKER.record_success( machine.ip_address )
+        return result
+
+    async def _worker( progress_bar ):
+        # The event loop is single threaded, so the workers can share the iterator.
+        for index, machine in pending:
+            if on_start != None:
+                on_start( machine )
+            try:
+                results[ index ] = await _host( machine )
+            except Exception as e:
+                logger.exception( e )
+            if on_result != None:
+                on_result( machine, results[ index ] )
+            progress_bar.update( 1 )
+
+    async def _main():
+        with tqdm( total = len( machines ), disable = not progress ) as progress_bar:
+            await asyncio.gather( *[ _worker( progress_bar ) for _ in range( max( 1, min( max_inflight( config ), len( machines ) ) ) ) ] )
+
+    asyncio.run( _main() )
+    return results
+
+# DigitalOcean creates at most this many droplets per request.
+CREATE_BATCH_SIZE = 10
+# Seconds a new droplet may take to become reachable over ssh, and the polling backoff bounds.
+READY_TIMEOUT = 10 * 60
+READY_POLL_MIN = 2
+READY_POLL_MAX = 15
+# Seconds one readiness probe may take to connect, authenticate and run a command.
+READY_PROBE_TIMEOUT = 10
+
+def create_droplets( config, names ) -> dict:
+    """ Creates droplets for names with one projects/keys fetch and one API call per batch of machines sharing
+        region, size and image. Returns the created droplets by name, names in failed batches are missing.
+    """
+    client = digitalocean.Manager( token = config.token )
     projects = client.get_all_projects()
     keys = client.get_all_sshkeys()
-    droplet = digitalocean.Droplet( 
-        name = name,
-        region = config.machines[name].region,
-        size_slug = config.machines[name].slug,
-        image = config.machines[name].image,
-        ssh_keys = keys,
-        token = config.token,
-        tags = [ config.cluster ]
-    )
-    droplet.create()
+    groups = {}
+    for name in names:
+        machine = config.machines[name]
+        image = config.golden_image if 'golden_image' in config else machine.image
+        groups.setdefault( ( machine.region, machine.slug, image ), [] ).append( name )
+
+    created = {}
+    for ( region, slug, image ), group in groups.items():
+        for i in range( 0, len( group ), CREATE_BATCH_SIZE ):
+            batch = group[ i: i + CREATE_BATCH_SIZE ]
+            try:
+                droplets = digitalocean.Droplet.create_multiple( names = batch, region = region, size_slug = slug, image = image, ssh_keys = keys, token = config.token, tags = [ config.cluster ] )
+                created.update( { droplet.name: droplet for droplet in droplets } )
+            except Exception as e:
+                logger.error( 'Failed to create droplets {}: {}', batch, e )
 
     # Optionally assign to the cluster project.
     for p in projects:
-        if p.name == config.cluster:
-            p.assign_resource(["do:droplet:{}".format(droplet.id)])
+        if p.name == config.cluster and len( created ) > 0:
+            p.assign_resource( [ "do:droplet:{}".format( droplet.id ) for droplet in created.values() ] )
             break
+    return created
 
-    time.sleep(30)
-    return True
+def ssh_ready( config, host: str ) -> bool:
+    """ True once the host accepts the ssh key and runs a command. Right after boot the daemon answers before the key
+        is installed, so an authentication failure only means not yet. The probe uses its own connection, outside the
+        pool and the circuit breaker.
+    """
+    key = load_private_key( os.path.expanduser( config.sshkey ) )
+    connection = Connection( host, user = 'root', port = SSH_PORT, connect_timeout = READY_PROBE_TIMEOUT, connect_kwargs = { "pkey": key, "look_for_keys": False, "allow_agent": False, "banner_timeout": READY_PROBE_TIMEOUT, "auth_timeout": READY_PROBE_TIMEOUT } )
+    try:
+        return connection.run( 'true', hide = True, warn = True, in_stream = False, timeout = READY_PROBE_TIMEOUT ).ok
+    except Exception as e:
+        logger.debug( '{}: Not ready yet: {}', host, e )
+        return False
+    finally:
+        connection.close()
+
+class DropletCreator:
+    """ Creates all requested droplets in batches the first time any of them is asked for, then lets each caller wait
+        for just its own droplet: active, addressed and accepting the ssh key. Waiters share one listing of the
+        cluster per poll interval, so polling costs one API call per interval however many hosts are pending.
+    """
+    def __init__( self, config, names ):
+        self.config = config
+        self.names = list( names )
+        self.lock = threading.Lock()
+        self.created = None
+        self.listed = {}
+        self.listed_at = 0
+
+    def _listed( self, name, max_age: float ):
+        with self.lock:
+            if time.time() - self.listed_at > max_age:
+                client = digitalocean.Manager( token = self.config.token )
+                self.listed = { droplet.name: droplet for droplet in client.get_all_droplets( tag_name = self.config.cluster ) }
+                self.listed_at = time.time()
+            return self.listed.get( name )
+
+    def create( self, name ):
+        """ Returns the droplet once it is usable or None if it could not be created or never became ready. """
+        with self.lock:
+            if self.created == None:
+                try: self.created = create_droplets( self.config, self.names )
+                except Exception as e: logger.exception( e ); self.created = {}
+        if name not in self.created: return None
+
+        delay = READY_POLL_MIN
+        deadline = time.time() + READY_TIMEOUT
+        while time.time() < deadline:
+            time.sleep( delay )
+            droplet = self._listed( name, delay )
+            if droplet != None and droplet.status == 'active' and droplet.ip_address and ssh_ready( self.config, droplet.ip_address ):
+                record_droplet( self.config, droplet )
+                return droplet
+            delay = min( delay * 1.5, READY_POLL_MAX )
+        logger.error( '<blue>{}</blue>: Droplet not ready after {}s', name, READY_TIMEOUT )
+        return None
+
+# Seconds between checks, and checks, while DigitalOcean snapshots or transfers an image.
+IMAGE_POLL = 10
+IMAGE_POLLS = 360
+
+def strip_host_state( config, connection ):
+    """ Removes what belongs to this host alone (wallets, pm2 processes) so its image can boot other machines. """
+    strip_command = "pm2 delete all || true ; pm2 save --force || true ; rm -rf ~/.bittensor/wallets"
+    logger.debug("Stripping host state: {}", strip_command)
+    strip_result = connection.run(strip_command, hide=not config.debug, warn=True)
+    logger.debug(strip_result)
+    return strip_result
 
+def take_golden_snapshot( config, droplet, snapshot_name: str ) -> int:
+    """ Snapshots the powered off droplet, powers it back on and transfers the image to every region used by the
+        configured machines. Returns the image id.
+    """
+    client = digitalocean.Manager( token = config.token )
+    source = client.get_droplet( droplet.id )
+    if not source.take_snapshot( snapshot_name, return_dict = False, power_off = True ).wait( IMAGE_POLL, IMAGE_POLLS ):
+        raise ValueError( 'Snapshot {} of {} did not complete'.format( snapshot_name, droplet.name ) )
+    source.power_on()
+    source.load()
+    image = [ snapshot for snapshot in source.get_snapshots() if client.get_image( snapshot.id ).name == snapshot_name ][0]
+
+    transfers = []
+    for region in set( machine.region for machine in config.machines.values() ) - set( [ source.region['slug'] ] ):
+        transfer = image.transfer( region )['action']
+        transfers.append( digitalocean.Action( id = transfer['id'], token = config.token ) )
+    for transfer in transfers:
+        transfer.load()
+        if not transfer.wait( IMAGE_POLL, IMAGE_POLLS ): raise ValueError( 'Transfer of image {} did not complete'.format( image.id ) )
+    return image.id
+
+def record_golden_image( config, image_id: int ):
+    """ Sets golden_image in the config file, replacing an existing value or appending it. """
+    path = 'configs/' + config.config_file + '.yaml'
+    with open( path ) as f: lines = f.readlines()
+    for i, line in enumerate( lines ):
+        if line.startswith( 'golden_image:' ):
+            lines[i] = 'golden_image: {}\n'.format( image_id )
+            break
+    else:
+        if len( lines ) > 0 and not lines[-1].endswith( '\n' ): lines[-1] += '\n'
+        lines += [ '\n', '# Snapshot new droplets boot from, recorded by marius snapshot.\n', 'golden_image: {}\n'.format( image_id ) ]
+    with open( path, 'w' ) as f: f.writelines( lines )
+
+def create_droplet( config, name ) -> bool:
+    return DropletCreator( config, [ name ] ).create( name ) != None
 
 def droplet_with_name( config, name: str, tags ):
-    manager = digitalocean.Manager( token =  config.token)
-    droplets = manager.get_all_droplets( tag_name = [ config.cluster if tags == None else list(tags) ])
-    for droplet in droplets:
-        if droplet.name == name:
-            return droplet
-    return None
-
-def install_python_deps( config, connection ):
-    install_python_deps_command = "sudo apt-get update && sudo apt-get install --no-install-recommends --no-install-suggests -y apt-utils curl git cmake build-essential gnupg lsb-release ca-certificates software-properties-common apt-transport-https"
-    logger.debug("Installing python deps: {}", install_python_deps_command)
-    install_python_deps_result = connection.run(install_python_deps_command, hide=not config.debug, warn=True)
-    logger.debug(install_python_deps_result)
-    return install_python_deps_result
-
-def install_python( config, connection ):
-    install_python_command = "sudo apt-get install --no-install-recommends --no-install-suggests -y python3"
-    logger.debug("Installing python: {}", install_python_command)
-    install_python_result = connection.run(install_python_command, hide=not config.debug, warn=True)
-    logger.debug(install_python_result)
-    return install_python_result
-
-def install_bittensor_deps( config, connection ):
-    install_bittensor_deps_command = "sudo apt-get install --no-install-recommends --no-install-suggests -y python3-pip python3-dev python3-venv"
-    logger.debug("Installing bittensor deps: {}", install_bittensor_deps_command)
-    install_bittensor_deps_result = connection.run(install_bittensor_deps_command, hide=not config.debug, warn=True)
-    logger.debug(install_bittensor_deps_result)
-    return install_bittensor_deps_result
-
-def install_swapspace( config, connection ):
-    install_swap_command = "ulimit -n 50000 && sudo fallocate -l 20G /swapfile && sudo chmod 600 /swapfile && sudo mkswap /swapfile && sudo swapon /swapfile && sudo cp /etc/fstab /etc/fstab.bak"
-    logger.debug("Installing swapspace: {}", install_swap_command)
-    install_swap_result = connection.run(install_swap_command, hide=not config.debug, warn=True)
-    logger.debug(install_swap_result)
-    return install_swap_result
-
-def install_npm( config, connection ):
-    install_npm_command = "sudo apt install npm -y"
-    logger.debug("Installing npm: {}", install_npm_command)
-    install_npm_result = connection.run(install_npm_command, hide=not config.debug, warn=True)
-    logger.debug(install_npm_result)
-    return install_npm_result
-
-def install_pm2( config, connection ):
-    install_pm2_command = "sudo npm install pm2@latest -g"
-    logger.debug("Installing pm2: {}", install_pm2_command)
-    install_pm2_result = connection.run(install_pm2_command, hide=not config.debug, warn=True)
-    logger.debug(install_pm2_result)
-    return install_pm2_result
-
-def install_bittensor( config, connection ):
-    install_command = "cd ~/.bittensor/bittensor ; pip3 install -e ."
-    logger.debug("Installing bittensor: {}", install_command)
-    install_result = connection.run(install_command, hide=not config.debug, warn=True)
+    tags = [ config.cluster ] if tags == None else list( tags )
+    def _find( inventory ):
+        for record in inventory['droplets'].values():
+            if record['name'] == name and ( config.cluster == 'all' or len( set( tags ) & set( record['tags'] ) ) > 0 ):
+                return _droplet_from_record( record )
+        return None
+    droplet = _find( get_inventory( config ) )
+    if droplet == None:
+        droplet = _find( refresh_inventory( config ) )
+    return droplet
+
+# Remote directory with one marker file per completed install step, holding that step's fingerprint.
+STEPS_DIR = '~/.marius/steps'
+SKIPPED_STEP = 'MARIUS_STEP_UP_TO_DATE'
+
+def step_digest( command: str ) -> str:
+    return hashlib.sha256( command.encode() ).hexdigest()[:16]
+
+def install_timeout( config ) -> float:
+    return config.install_timeout if 'install_timeout' in config else INSTALL_TIMEOUT
+
+def run_step( config, connection, step: str, command: str, inputs: str = None, **kwargs ):
+    """ Runs an install step unless the marker on the host matches the step's fingerprint.
+        The fingerprint hashes the command and appends the output of the optional inputs shell snippet, so the step
+        re-runs when its command changes or when the remote state it depends on does. Pass --force to ignore markers.
+        The returned result has skipped set when nothing ran. Steps run under install_timeout instead of the host deadline.
+    """
+    kwargs.setdefault( 'timeout', install_timeout( config ) )
+    digest = step_digest( command )
+    marker = '{}/{}'.format( STEPS_DIR, step )
+    step_command = "mkdir -p {} ; fingerprint() {{ echo {}$( {} ) ; }} ; ".format( STEPS_DIR, digest, inputs if inputs != None else 'true' )
+    if not ( 'force' in config and config.force ):
+        step_command += 'if [ "$(cat {} 2>/dev/null)" = "$(fingerprint)" ]; then echo {}; exit 0; fi ; '.format( marker, SKIPPED_STEP )
+    step_command += "( {} ) && fingerprint > {}".format( command, marker )
+    logger.debug("Running step {}: {}", step, step_command)
+    step_result = connection.run( step_command, **kwargs )
+    step_result.skipped = SKIPPED_STEP in step_result.stdout
+    if step_result.skipped:
+        logger.debug("Step {} is up to date on {}", step, connection.host)
+    return step_result
+
+# Every apt package the hosts need, resolved in one transaction.
+APT_PACKAGES = [ 'apt-utils', 'curl', 'git', 'cmake', 'build-essential', 'gnupg', 'lsb-release', 'ca-certificates', 'software-properties-common', 'apt-transport-https', 'python3', 'python3-pip', 'python3-dev', 'python3-venv', 'npm', 'docker.io' ]
+
+# The provisioning plan as ( step, command, fingerprint inputs, required ). A failed optional step does not stop the plan.
+PROVISION_STEPS = [
+    ( 'swapspace', "ulimit -n 50000 && sudo fallocate -l 20G /swapfile && sudo chmod 600 /swapfile && sudo mkswap /swapfile && sudo swapon /swapfile && sudo cp /etc/fstab /etc/fstab.bak", 'swapon --show=NAME --noheadings', False ),
+    ( 'apt', "sudo apt-get update && sudo DEBIAN_FRONTEND=noninteractive apt-get install --no-install-recommends --no-install-suggests -y " + ' '.join( APT_PACKAGES ), None, True ),
+    ( 'pm2', "sudo npm install pm2@latest -g", 'which pm2', True ),
+]
+BITTENSOR_SOURCE_STEP = ( 'bittensor', "cd ~/.bittensor/bittensor ; pip3 install -e .", 'cd ~/.bittensor/bittensor && git rev-parse HEAD', False )
+
+PROVISION_SCRIPT = '/tmp/marius-provision.sh'
+PROGRESS_PREFIX = 'MARIUS_STEP '
+PROVISION_HEADER = r'''#!/bin/bash
+# Provisioning plan rendered by marius. Steps share their fingerprints in ~/.marius/steps with run_step and
+# each one reports a single MARIUS_STEP json line, its output goes to ~/.marius/logs/<step>.log.
+mkdir -p ~/.marius/steps ~/.marius/logs
+fingerprint() { echo $1$(eval "$2"); }
+step() {
+    local name=$1 digest=$2 inputs=$3 command=$4 start code ms
+    if [ -z "$MARIUS_FORCE" ] && [ "$(cat ~/.marius/steps/$name 2>/dev/null)" = "$(fingerprint "$digest" "$inputs")" ]; then
+        echo "MARIUS_STEP {\"step\": \"$name\", \"skipped\": true, \"code\": 0, \"duration\": 0}"
+        return 0
+    fi
+    start=$(date +%s%N)
+    ( eval "$command" ) > ~/.marius/logs/$name.log 2>&1
+    code=$?
+    if [ $code -eq 0 ]; then fingerprint "$digest" "$inputs" > ~/.marius/steps/$name; else tail -n 20 ~/.marius/logs/$name.log >&2; fi
+    ms=$(( ( $(date +%s%N) - start ) / 1000000 ))
+    printf 'MARIUS_STEP {"step": "%s", "skipped": false, "code": %d, "duration": %d.%03d}\n' $name $code $(( ms / 1000 )) $(( ms % 1000 ))
+    return $code
+}
+'''
+
+def render_provision_script( steps ) -> str:
+    lines = [ PROVISION_HEADER ]
+    for step, command, inputs, required in steps:
+        lines.append( 'step {} {} {} {} {}'.format( step, step_digest( command ), shlex.quote( inputs if inputs != None else 'true' ), shlex.quote( command ), '|| exit $?' if required else '|| true' ) )
+    return '\n'.join( lines ) + '\n'
+
+class StepProgress:
+    """ Output stream for a provisioning run, logs each MARIUS_STEP record as it arrives and keeps them in steps. """
+    def __init__( self, config, name: str ):
+        self.config = config
+        self.name = name
+        self.buffer = ''
+        self.steps = []
+
+    def write( self, data: str ):
+        self.buffer += data
+        while '\n' in self.buffer:
+            line, self.buffer = self.buffer.split( '\n', 1 )
+            if not line.startswith( PROGRESS_PREFIX ):
+                logger.debug( '<blue>{}</blue>: {}', self.name, line )
+                continue
+            step = json.loads( line[ len( PROGRESS_PREFIX ): ] )
+            self.steps.append( step )
+            if step['skipped']: logger.success( '<blue>{}</blue>: {} up to date.', self.name, step['step'] )
+            elif step['code'] == 0: logger.success( '<blue>{}</blue>: {} done in {:.1f}s.', self.name, step['step'], step['duration'] )
+            else: logger.error( '<blue>{}</blue>: {} failed with exit code {} after {:.1f}s.', self.name, step['step'], step['code'], step['duration'] )
+
+    def flush( self ):
+        pass
+
+def provision( config, connection, name: str, steps ):
+    """ Uploads the rendered plan and runs it in one session, the result carries the step records in steps. """
+    script = render_provision_script( steps )
+    logger.debug("Provisioning script: {}", script)
+    connection.put( io.StringIO( script ), PROVISION_SCRIPT )
+    progress = StepProgress( config, name )
+    force = 'MARIUS_FORCE=1 ' if 'force' in config and config.force else ''
+    provision_result = connection.run( '{}bash {}'.format( force, PROVISION_SCRIPT ), out_stream = progress, hide = None if config.debug else 'err', warn = True, pty = False, timeout = install_timeout( config ) )
+    provision_result.steps = progress.steps
+    logger.debug(provision_result)
+    # The failing step's log tail is on stderr, which is hidden without --debug.
+    if provision_result.failed and not config.debug: logger.error('<blue>{}</blue>: Provisioning output:\n{}', name, provision_result.stderr.strip())
+    return provision_result
+
+# Controller side package cache, hosts reach it on the same port through a reverse ssh tunnel during install.
+CACHE_DIR = os.path.join( MARIUS_DIR, 'cache' )
+CACHE_PORT = 3142
+# Published packages never change, so only these are cached. Indexes and metadata are always fetched fresh.
+CACHEABLE = ( '.deb', '.whl', '.tar.gz', '.tgz', '.tar.bz2', '.zip' )
+CACHE_CHUNK = 1 << 16
+PACKAGE_CACHE_LOCK = threading.Lock()
+PACKAGE_CACHE = {}
+
+class PackageCacheHandler( http.server.BaseHTTPRequestHandler ):
+    """ Serves proxy requests (apt: GET http://host/path) and mirror paths (pip, npm: GET /https/host/path).
+        Links in html and json responses are rewritten to mirror paths so package downloads come back here too.
+    """
+    def log_message( self, format, *args ):
+        logger.trace( 'package cache: ' + format, *args )
+
+    def upstream_url( self ) -> str:
+        if self.path.startswith( 'http://' ): return self.path
+        for scheme in [ 'https', 'http' ]:
+            if self.path.startswith( '/{}/'.format( scheme ) ): return '{}://{}'.format( scheme, self.path[ len( scheme ) + 2: ] )
+        return None
+
+    def do_GET( self ):
+        url = self.upstream_url()
+        if url == None: self.send_error( 404 ); return
+        cached = os.path.join( CACHE_DIR, hashlib.sha256( url.encode() ).hexdigest() )
+        if os.path.exists( cached ):
+            self.send_response( 200 )
+            self.send_header( 'Content-Length', str( os.path.getsize( cached ) ) )
+            self.end_headers()
+            with open( cached, 'rb' ) as f: shutil.copyfileobj( f, self.wfile )
+            return
+        try:
+            request = urllib.request.Request( url, headers = { 'Accept': self.headers.get( 'Accept', '*/*' ), 'User-Agent': self.headers.get( 'User-Agent', 'marius' ) } )
+            upstream = urllib.request.urlopen( request, timeout = 60 )
+        except urllib.error.HTTPError as e:
+            self.send_error( e.code ); return
+        except Exception as e:
+            logger.debug( 'package cache: {} failed: {}', url, e ); self.send_error( 502 ); return
+
+        with upstream:
+            content_type = upstream.headers.get( 'Content-Type', 'application/octet-stream' )
+            if 'html' in content_type or 'json' in content_type:
+                body = upstream.read().replace( b'https://', 'http://{}/https/'.format( self.headers['Host'] ).encode() )
+                self.send_response( 200 )
+                self.send_header( 'Content-Type', content_type )
+                self.send_header( 'Content-Length', str( len( body ) ) )
+                self.end_headers()
+                self.wfile.write( body )
+                return
+
+            self.send_response( 200 )
+            self.send_header( 'Content-Type', content_type )
+            if upstream.headers.get( 'Content-Length' ): self.send_header( 'Content-Length', upstream.headers['Content-Length'] )
+            self.end_headers()
+            keep = url.split( '?' )[0].endswith( CACHEABLE )
+            partial = '{}.{}.tmp'.format( cached, threading.get_ident() )
+            with ( open( partial, 'wb' ) if keep else contextlib.nullcontext() ) as f:
+                for chunk in iter( lambda: upstream.read( CACHE_CHUNK ), b'' ):
+                    self.wfile.write( chunk )
+                    if keep: f.write( chunk )
+            if keep: os.replace( partial, cached )
+
+def start_package_cache( config ) -> int:
+    """ Starts the package cache on the controller once per process and returns its port. """
+    port = config.package_cache_port if 'package_cache_port' in config else CACHE_PORT
+    with PACKAGE_CACHE_LOCK:
+        if port not in PACKAGE_CACHE:
+            os.makedirs( CACHE_DIR, exist_ok = True )
+            server = http.server.ThreadingHTTPServer( ( '127.0.0.1', port ), PackageCacheHandler )
+            server.daemon_threads = True
+            threading.Thread( target = server.serve_forever, daemon = True ).start()
+            PACKAGE_CACHE[ port ] = server
+            logger.info( 'Package cache listening on 127.0.0.1:{} ({})', port, CACHE_DIR )
+    return port
+
+def package_cache_configs( port: int ) -> dict:
+    """ Files pointing apt, pip and npm on a host at the tunnelled cache. """
+    mirror = 'http://127.0.0.1:{}'.format( port )
+    return {
+        '/etc/apt/apt.conf.d/01marius-cache': 'Acquire::http::Proxy "{}";\n'.format( mirror ),
+        '/etc/pip.conf': '[global]\nindex-url = {}/https/pypi.org/simple\ntrusted-host = 127.0.0.1\n'.format( mirror ),
+        '~/.npmrc': 'registry={}/https/registry.npmjs.org/\n'.format( mirror ),
+    }
+
+@contextlib.contextmanager
+def package_cache( config, connection ):
+    """ With package_cache set, apt, pip and npm on the host download through the controller's cache while active.
+        The host side configuration is removed again on exit so the host never depends on the tunnel afterwards.
+    """
+    if not ( 'package_cache' in config and config.package_cache ):
+        yield
+        return
+    port = start_package_cache( config )
+    configs = package_cache_configs( port )
+    with connection.forward_remote( port, local_port = port, local_host = '127.0.0.1' ):
+        # Existing files are set aside and restored afterwards.
+        configure_command = ' && '.join( "{{ [ ! -e {0} ] || mv {0} {0}.marius; }} && printf %s {1} > {0}".format( path, shlex.quote( content ) ) for path, content in configs.items() )
+        restore_command = ' ; '.join( "rm -f {0} ; [ ! -e {0}.marius ] || mv {0}.marius {0}".format( path ) for path in configs )
+        logger.debug("Pointing host at package cache: {}", configure_command)
+        connection.run( configure_command, hide = not config.debug )
+        try:
+            yield
+        finally:
+            connection.run( restore_command, hide = not config.debug, warn = True )
+
+# Controller side wheelhouses, one per branch, and where hosts receive them.
+WHEELHOUSE_DIR = os.path.join( MARIUS_DIR, 'wheelhouse' )
+REMOTE_WHEELHOUSE_DIR = '.marius/wheelhouse'
+# Guards WHEELHOUSE_LOCKS only. Each branch builds under its own lock, so a build does not hold up other branches.
+WHEELHOUSE_LOCK = threading.Lock()
+WHEELHOUSE_LOCKS = {}
+WHEELHOUSES = {}
+
+def install_mode( config ) -> str:
+    return config.install_mode if 'install_mode' in config else 'source'
+
+def build_wheelhouse( config, connection, branch ) -> str:
+    """ Builds wheels for bittensor at branch (or tags/<tag>) and all of its dependencies on the first host that asks,
+        so compiled wheels match the hosts' python and platform rather than the controller's, and pulls them back to
+        the controller to be pushed from there. Built once per run and only rebuilt when the branch moves, reusing the
+        previous wheels so just the changed packages are downloaded. Returns the wheelhouse directory.
+    """
+    with WHEELHOUSE_LOCK:
+        branch_lock = WHEELHOUSE_LOCKS.setdefault( branch, threading.Lock() )
+    with branch_lock:
+        if branch in WHEELHOUSES: return WHEELHOUSES[ branch ]
+        # Annotated tags list the peeled commit after the tag object.
+        refs = [ "refs/%s" % branch, "refs/%s^{}" % branch ] if "tags/" in branch else [ "refs/heads/%s" % branch ]
+        ls_remote = subprocess.run( [ 'git', 'ls-remote', BITTENSOR_REPO ] + refs, capture_output = True, text = True, check = True )
+        if ls_remote.stdout.strip() == '': raise ValueError( 'Unknown bittensor branch: {}'.format( branch ) )
+        commit = ls_remote.stdout.strip().split('\n')[-1].split()[0]
+
+        wheelhouse = os.path.join( WHEELHOUSE_DIR, branch.replace( '/', '-' ) )
+        commit_path = os.path.join( wheelhouse, 'COMMIT' )
+        built = None
+        if os.path.exists( commit_path ):
+            with open( commit_path ) as f: built = f.read().strip()
+        if built != commit:
+            logger.info( 'Building wheelhouse for <blue>{}</blue> at {} on {}', branch, commit[:8], connection.host )
+            remote = '{}/{}'.format( REMOTE_WHEELHOUSE_DIR, os.path.basename( wheelhouse ) )
+            build_command = "rm -rf {0}.tmp && mkdir -p {0}.tmp && pip3 wheel --quiet --wheel-dir {0}.tmp --find-links {0} git+{1}@{2} && echo {2} > {0}.tmp/COMMIT".format( remote, BITTENSOR_REPO, commit )
+            logger.debug("Building wheelhouse: {}", build_command)
+            build_result = connection.run( build_command, hide = not config.debug, warn = True, timeout = install_timeout( config ) )
+            if build_result.failed: raise ValueError( 'Failed to build the wheelhouse on {}: {}'.format( connection.host, build_result.stderr[-2000:] ) )
+
+            building = wheelhouse + '.tmp'
+            shutil.rmtree( building, ignore_errors = True )
+            os.makedirs( building )
+            ssh = 'ssh -i {} -p {} -o StrictHostKeyChecking=no -o BatchMode=yes'.format( os.path.expanduser( config.sshkey ), connection.port )
+            subprocess.run( [ 'rsync', '-a', '-e', ssh, '{}@{}:{}.tmp/'.format( connection.user, connection.host, remote ), building + '/' ], check = True )
+            connection.run( 'rm -rf {}.tmp'.format( remote ), hide = not config.debug, warn = True )
+            shutil.rmtree( wheelhouse, ignore_errors = True )
+            os.replace( building, wheelhouse )
+        if not os.path.exists( os.path.join( wheelhouse, MANIFEST ) ): write_manifest( wheelhouse )
+        WHEELHOUSES[ branch ] = wheelhouse
+        return wheelhouse
+
+# Prints the wheel tags the host's python3 accepts, most specific first.
+HOST_TAGS_SCRIPT = """
+try: from packaging import tags
+except ImportError: from pip._vendor.packaging import tags
+print( '\\n'.join( str( tag ) for tag in tags.sys_tags() ) )
+"""
+
+def wheel_tags( filename: str ) -> set:
+    """ The python-abi-platform tags of a wheel file name, expanding compressed tag sets such as py2.py3. """
+    python, abi, platform = filename[ : -len( '.whl' ) ].split( '-' )[ -3: ]
+    return set( '{}-{}-{}'.format( p, a, o ) for p in python.split( '.' ) for a in abi.split( '.' ) for o in platform.split( '.' ) )
+
+def check_wheel_tags( config, connection, wheelhouse ):
+    """ Raises if any wheel in the wheelhouse can not be installed by the host's python3. """
+    tags_result = connection.run( "python3 -c {}".format( shlex.quote( HOST_TAGS_SCRIPT ) ), hide = True, warn = True )
+    if tags_result.failed: raise ValueError( 'Failed to read the python tags of {}'.format( connection.host ) )
+    supported = set( tags_result.stdout.split() )
+    mismatched = [ name for name in sorted( os.listdir( wheelhouse ) ) if name.endswith( '.whl' ) and len( wheel_tags( name ) & supported ) == 0 ]
+    if len( mismatched ) > 0: raise ValueError( 'Wheels not supported by python3 on {}: {}'.format( connection.host, ', '.join( mismatched ) ) )
+
+MANIFEST = 'SHA256SUMS'
+
+def write_manifest( directory ):
+    """ Writes a sha256sum compatible manifest of every file in directory. """
+    lines = []
+    for name in sorted( os.listdir( directory ) ):
+        if name == MANIFEST: continue
+        with open( os.path.join( directory, name ), 'rb' ) as f:
+            lines.append( '{}  {}\n'.format( hashlib.sha256( f.read() ).hexdigest(), name ) )
+    with open( os.path.join( directory, MANIFEST ), 'w' ) as f: f.writelines( lines )
+
+def verify_artifact( config, connection, directory, target ) -> bool:
+    """ True if every file of the artifact on the host matches the controller's manifest. """
+    with open( os.path.join( directory, MANIFEST ), 'rb' ) as f: digest = hashlib.sha256( f.read() ).hexdigest()
+    verify_command = "cd {} && sha256sum --quiet -c {} && sha256sum {}".format( target, MANIFEST, MANIFEST )
+    verify_result = connection.run( verify_command, hide = not config.debug, warn = True )
+    return not verify_result.failed and verify_result.stdout.split()[-2] == digest
+
+class FanOut:
+    """ Hands out a source for each host that needs an artifact. Hosts holding a verified copy become sources
+        themselves, each source serving at most fanout hosts at once, so the number of copies roughly multiplies by
+        fanout + 1 every round and the controller's uplink is only used for the first few.
+        A source of None means the controller.
+    """
+    def __init__( self, fanout: int ):
+        self.fanout = fanout
+        self.condition = threading.Condition()
+        self.seeds = []
+        self.active = { None: 0 }
+
+    def acquire( self, controller: bool = False ):
+        """ Waits for a source with a free slot, with controller only for one of the controller's slots. """
+        with self.condition:
+            while True:
+                for seed in ( [] if controller else self.seeds ) + [ None ]:
+                    key = seed if seed == None else ( seed.host, seed.user )
+                    if self.active[ key ] < self.fanout:
+                        self.active[ key ] += 1
+                        return seed
+                self.condition.wait()
+
+    def release( self, source, target = None, failed = False ):
+        with self.condition:
+            key = source if source == None else ( source.host, source.user )
+            self.active[ key ] -= 1
+            if failed and source in self.seeds: self.seeds.remove( source )
+            if target != None and ( target.host, target.user ) not in self.active:
+                self.seeds.append( target )
+                self.active[ ( target.host, target.user ) ] = 0
+            self.condition.notify_all()
+
+FANOUTS = {}
+FANOUTS_LOCK = threading.Lock()
+
+def fanout_for( artifact: str, fanout: int ) -> FanOut:
+    with FANOUTS_LOCK:
+        if artifact not in FANOUTS: FANOUTS[ artifact ] = FanOut( fanout )
+        return FANOUTS[ artifact ]
+
+def relay_artifact( config, source, connection, target ):
+    """ Rsyncs target from the source host to the host behind connection, authenticating with the forwarded agent. """
+    relay_command = "rsync -a --delete -e 'ssh -o StrictHostKeyChecking=no -o BatchMode=yes' {0}/ {1}@{2}:{0}/".format( target, connection.user, connection.host )
+    logger.debug("Relaying {} from {} to {}: {}", target, source.host, connection.host, relay_command)
+    return source.run( relay_command, hide = not config.debug, warn = True )
+
+def relay_wheelhouse( config, fan_out, source, connection, wheelhouse, target ) -> bool:
+    """ Relays the wheelhouse from source to the host and releases the source's slot. Returns whether the host got a
+        verified copy. A failed relay only drops the source when its own copy does not verify or it can not be reached,
+        the target may as well be at fault.
+    """
+    relayed, source_failed = False, False
+    try: relayed = not relay_artifact( config, source, connection, target ).failed and verify_artifact( config, connection, wheelhouse, target )
+    except Exception as e: logger.debug( e )
+    if not relayed:
+        try: source_failed = not verify_artifact( config, source, wheelhouse, target )
+        except Exception as e: logger.debug( e ); source_failed = True
+    fan_out.release( source, connection if relayed else None, failed = source_failed )
+    return relayed
+
+def push_wheelhouse( config, connection, wheelhouse ):
+    """ Rsyncs the wheelhouse to the host, only changed wheels are transferred on upgrades.
+        With fanout set, hosts which already hold a verified copy relay it onwards and the controller is the fallback.
+    """
+    target = '{}/{}'.format( REMOTE_WHEELHOUSE_DIR, os.path.basename( wheelhouse ) )
+    connection.run( 'mkdir -p {}'.format( target ), hide = not config.debug )
+    fanout = config.fanout if 'fanout' in config else 0
+    if fanout > 0:
+        fan_out = fanout_for( wheelhouse, fanout )
+        source = fan_out.acquire()
+        if source != None:
+            if relay_wheelhouse( config, fan_out, source, connection, wheelhouse, target ): return
+            logger.warning( '<blue>{}</blue>: Relay from {} failed, pushing from the controller', connection.host, source.host )
+            # The fallback push takes a controller slot like every other push from the controller.
+            fan_out.acquire( controller = True )
+    try:
+        logger.debug("Pushing wheelhouse: {} -> {}:{}", wheelhouse, connection.host, target)
+        rsync( connection, wheelhouse + '/', target, delete = True, strict_host_keys = False, ssh_opts = '-i {}'.format( os.path.expanduser( config.sshkey ) ) )
+        if not verify_artifact( config, connection, wheelhouse, target ): raise ValueError( 'Wheelhouse checksum mismatch on {}'.format( connection.host ) )
+    except:
+        if fanout > 0: fan_out.release( None )
+        raise
+    if fanout > 0: fan_out.release( None, connection )
+
+def install_bittensor_wheelhouse( config, connection, branch ):
+    """ Installs bittensor offline from the wheelhouse for branch, built on the first host to get here. """
+    wheelhouse = build_wheelhouse( config, connection, branch )
+    check_wheel_tags( config, connection, wheelhouse )
+    push_wheelhouse( config, connection, wheelhouse )
+    target = '~/{}/{}'.format( REMOTE_WHEELHOUSE_DIR, os.path.basename( wheelhouse ) )
+    install_command = "pip3 install --no-index --find-links {0} --upgrade {0}/bittensor-*.whl && pip3 install --no-index --no-deps --force-reinstall {0}/bittensor-*.whl".format( target )
+    logger.debug("Installing bittensor from wheelhouse: {}", install_command)
+    install_result = run_step(config, connection, 'bittensor', install_command, 'cat {}/COMMIT'.format( target ), hide=not config.debug, warn=True)
     return install_result
 
 def is_installed( config, connection ) -> bool:
@@ -180,12 +1083,33 @@ def remove_bittensor_installation( config, connection ):
     logger.debug(remove_result)
     return remove_result
 
-def git_clone_bittensor( config, connection ):
-    clone_bittensor = "git clone --recurse-submodules https://github.com/opentensor/bittensor.git ~/.bittensor/bittensor"
-    logger.debug("Pulling bittensor from github: {}", clone_bittensor)
-    clone_result = connection.run(clone_bittensor, hide=not config.debug)
-    logger.debug(clone_result)
-    return clone_result
+BITTENSOR_REPO = 'https://github.com/opentensor/bittensor.git'
+
+def git_sync_bittensor( config, connection, branch ):
+    """ Brings ~/.bittensor/bittensor to the tip of branch (or tags/<tag>) reusing the existing clone.
+        Nothing is fetched when the remote ref already matches HEAD, otherwise only that ref is fetched at depth 1
+        and submodules are updated shallowly. A missing or broken clone is replaced by a shallow clone.
+        The returned result has skipped set when the checkout was already up to date.
+    """
+    if "tags/" in branch:
+        ref, name, local = "refs/%s" % branch, branch.split("/")[1], "tag-%s" % branch.split("/")[1]
+    else:
+        ref, name, local = "refs/heads/%s" % branch, branch, branch
+    sync_command = "\n".join([
+        "if ! git -C ~/.bittensor/bittensor rev-parse --git-dir > /dev/null 2>&1; then",
+        "  rm -rf ~/.bittensor/bittensor && git clone --depth 1 --recurse-submodules --shallow-submodules --branch {name} {repo} ~/.bittensor/bittensor && git -C ~/.bittensor/bittensor checkout -B {local}; exit $?",
+        "fi",
+        "cd ~/.bittensor/bittensor",
+        "remote=$(git ls-remote {repo} {ref} '{ref}^{{}}' | tail -n 1 | cut -f 1)",
+        "if [ -z \"$remote\" ]; then echo 'Unknown ref {ref}'; exit 1; fi",
+        "if [ \"$(git rev-parse HEAD)\" = \"$remote\" ] && [ \"$(git branch --show-current)\" = '{local}' ]; then echo {skipped}; exit 0; fi",
+        "git fetch --depth 1 {repo} {ref} && git checkout -f -B {local} FETCH_HEAD && git submodule update --init --recursive --depth 1",
+    ]).format( name = name, ref = ref, local = local, repo = BITTENSOR_REPO, skipped = SKIPPED_STEP )
+    logger.debug("Syncing bittensor checkout: {}", sync_command)
+    sync_result = connection.run(sync_command, hide=not config.debug, warn=True)
+    sync_result.skipped = SKIPPED_STEP in sync_result.stdout
+    logger.debug(sync_result)
+    return sync_result
 
 def git_pull_submodules( config, connection ):
     bittensor_submodules = "cd ~/.bittensor/bittensor; git submodule update --init --recursive"
@@ -283,6 +1207,281 @@ def get_fast_coldkeypub( config, connection ) -> str:
     coldkeypub_info = json.loads(cat_coldkey_result.stdout)
     return coldkeypub_info['ss58Address']
 
+def neurons_by_hotkey( subtensor ) -> dict:
+    """ Pulls every neuron from the chain in one query and indexes it by hotkey. """
+    logger.debug("Syncing neurons from: {}", subtensor)
+    return { neuron.hotkey: neuron for neuron in subtensor.neurons() if not neuron.is_null }
+
+# Above this many pending hotkeys one neurons sync per block is cheaper than a lookup per hotkey.
+WATCH_SYNC_THRESHOLD = 8
+
+class RegistrationWatcher:
+    """ Watches the chain for every pending hotkey from one background thread. The block number is polled each second
+        and pending hotkeys are looked up once per new block, so the cost does not grow with the number of hosts
+        registering. watch returns an Event which is set once the hotkey is registered.
+    """
+    def __init__( self, subtensor, block_time: float = 12 ):
+        self.subtensor = subtensor
+        self.block_time = block_time
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.thread = None
+
+    def watch( self, hotkey: str ) -> threading.Event:
+        with self.lock:
+            event = self.pending.setdefault( hotkey, threading.Event() )
+            if self.thread == None:
+                self.thread = threading.Thread( target = self._run, daemon = True )
+                self.thread.start()
+            return event
+
+    def registered( self, hotkeys ) -> list:
+        if len( hotkeys ) > WATCH_SYNC_THRESHOLD:
+            neurons = neurons_by_hotkey( self.subtensor )
+            return [ hotkey for hotkey in hotkeys if hotkey in neurons ]
+        return [ hotkey for hotkey in hotkeys if not self.subtensor.neuron_for_pubkey( hotkey ).is_null ]
+
+    def _run( self ):
+        last_block = None
+        while True:
+            with self.lock:
+                if len( self.pending ) == 0: self.thread = None; return
+                hotkeys = list( self.pending )
+            try:
+                block = self.subtensor.get_current_block()
+                if block == last_block: time.sleep( 1 ); continue
+                last_block = block
+                seen = time.time()
+                for hotkey in self.registered( hotkeys ):
+                    logger.debug("Hotkey {} registered at block {}", hotkey, block)
+                    with self.lock: self.pending.pop( hotkey ).set()
+                # The next block lands about one block time after this one was seen.
+                time.sleep( max( 0, seen + self.block_time - time.time() - 1 ) )
+            except Exception as e:
+                logger.debug("Registration watcher: {}", e)
+                time.sleep( 1 )
+
+class RegistrationScheduler:
+    """ Priority queue of unregistered hotkeys sharing one pool of hosts. Each hotkey is given up to workers hosts
+        (-1 spreads the pool evenly over the pending hotkeys) and hosts left idle once the queue is empty join the
+        hotkeys with the fewest hosts, so every host in the pool hashes for someone. Lower priority values go first.
+    """
+    def __init__( self, hosts, workers: int = -1 ):
+        self.hosts = list( hosts )
+        self.free = list( hosts )
+        self.workers = workers
+        self.queue = []
+        self.assigned = {}
+        self.priorities = {}
+        self.pushed = 0
+
+    def push( self, hotkey, priority: int = 0 ):
+        heapq.heappush( self.queue, ( priority, self.pushed, hotkey ) )
+        self.priorities[ hotkey ] = priority
+        self.pushed += 1
+
+    def pending( self ) -> int:
+        return len( self.queue ) + len( self.assigned )
+
+    def budget( self ) -> int:
+        if self.workers > 0: return self.workers
+        return max( 1, len( self.hosts ) // max( 1, self.pending() ) )
+
+    def assign( self ) -> list:
+        """ Hands free hosts out and returns the new ( hotkey, host ) assignments. """
+        assignments = []
+        budget = self.budget()
+        while len( self.queue ) > 0 and len( self.free ) > 0:
+            _, _, hotkey = heapq.heappop( self.queue )
+            hosts, self.free = self.free[ :budget ], self.free[ budget: ]
+            self.assigned[ hotkey ] = hosts
+            assignments += [ ( hotkey, host ) for host in hosts ]
+        while len( self.free ) > 0 and len( self.assigned ) > 0:
+            hotkey = min( self.assigned, key = lambda hotkey: len( self.assigned[ hotkey ] ) )
+            if self.workers > 0 and len( self.assigned[ hotkey ] ) >= self.workers: break
+            host = self.free.pop( 0 )
+            self.assigned[ hotkey ].append( host )
+            assignments.append( ( hotkey, host ) )
+        return assignments
+
+    def complete( self, hotkey ) -> list:
+        """ Marks hotkey registered and returns the hosts to stop, they are free for the remaining hotkeys. """
+        if any( entry[2] == hotkey for entry in self.queue ):
+            self.queue = [ entry for entry in self.queue if entry[2] != hotkey ]
+            heapq.heapify( self.queue )
+        hosts = self.assigned.pop( hotkey, [] )
+        self.free += hosts
+        return hosts
+
+    def release( self, hotkey, host ):
+        """ Takes a host which failed to start hashing for hotkey out of the pool, it would most likely fail again.
+            A hotkey left without hosts goes back in the queue with its priority.
+        """
+        if host in self.hosts: self.hosts.remove( host )
+        if host in self.assigned.get( hotkey, [] ): self.assigned[ hotkey ].remove( host )
+        if hotkey in self.assigned and len( self.assigned[ hotkey ] ) == 0:
+            del self.assigned[ hotkey ]
+            self.push( hotkey, self.priorities[ hotkey ] )
+
+# Neuron attributes kept for every host in a status record.
+NEURON_FIELDS = [ 'uid', 'stake', 'rank', 'trust', 'consensus', 'incentive', 'dividends', 'emission', 'last_update', 'active' ]
+
+def status_record_from_facts( droplet, facts, neurons ) -> dict:
+    """ Joins the facts probe_machine collected on a host with its neuron from the neurons_by_hotkey index. """
+    record = {
+        'name': droplet.name,
+        'tag': droplet.tags[0],
+        'ip': droplet.ip_address,
+        'region': droplet.region['name'],
+        'size': droplet.size_slug,
+        'connected': False,
+        'branch': None,
+        'installed': False,
+        'running': False,
+        'registered': False,
+        'hotkey': None,
+        'coldkeypub': None,
+    }
+    for field in NEURON_FIELDS:
+        record[ field ] = None
+    for fact in [ 'connected', 'branch', 'installed', 'running', 'hotkey', 'coldkeypub' ]:
+        record[ fact ] = facts.get( fact, record[ fact ] )
+    neuron = neurons.get( record['hotkey'] )
+    if neuron != None:
+        record['registered'] = True
+        for field in NEURON_FIELDS:
+            record[ field ] = getattr( neuron, field )
+    return record
+
+def status_record( config, droplet, neurons ) -> dict:
+    """ Probes a single host and joins it with its neuron from the neurons_by_hotkey index. """
+    start = time.time()
+    facts = {}
+    try:
+        connection = connection_for_machine( config, droplet )
+        facts = probe_machine( config, connection )
+        connection.close()
+    except Exception as e:
+        logger.error('{}: Failed to probe status error = {}', droplet.name, e )
+    record = status_record_from_facts( droplet, facts, neurons )
+    record['latency'] = time.time() - start
+    return record
+
+def status_records( config, droplets, neurons, on_start = None, on_result = None ) -> dict:
+    """ Probes every host over the asyncio runner, see status_record. on_result( droplet, record ) is called as each
+        host answers. Returns { name: record }.
+    """
+    started = {}
+    records = {}
+    def _start( droplet ):
+        started[ droplet.name ] = time.time()
+        if on_start != None:
+            on_start( droplet )
+
+    def _result( droplet, results ):
+        facts = parse_probe( results['probe'].stdout ) if results and 'probe' in results else { 'connected': False }
+        records[ droplet.name ] = status_record_from_facts( droplet, facts, neurons )
+        records[ droplet.name ]['latency'] = time.time() - started[ droplet.name ]
+        if on_result != None:
+            on_result( droplet, records[ droplet.name ] )
+
+    run_commands_on_machines( config, droplets, [ ( 'probe', PROBE_COMMAND, False ) ], on_start = _start, on_result = _result, progress = False )
+    return records
+
+# Status snapshots are appended to a local sqlite store so the last known state can be shown without probing.
+STATUS_DB = os.path.join( MARIUS_DIR, 'status.db' )
+REGISTRATION_COLUMNS = [ 'started', 'name', 'slug', 'hotkey', 'procs', 'duration', 'hashes', 'hashrate', 'difficulty', 'state', 'registered' ]
+SNAPSHOT_COLUMNS = [ 'name', 'tag', 'ip', 'region', 'size', 'connected', 'branch', 'installed', 'running', 'registered' ] + NEURON_FIELDS + [ 'coldkeypub', 'hotkey', 'latency' ]
+
+def _status_db() -> sqlite3.Connection:
+    os.makedirs( MARIUS_DIR, exist_ok = True )
+    db = sqlite3.connect( STATUS_DB )
+    db.row_factory = sqlite3.Row
+    db.execute( "CREATE TABLE IF NOT EXISTS snapshots ( run REAL, cluster TEXT, {} )".format( ', '.join( SNAPSHOT_COLUMNS ) ) )
+    db.execute( "CREATE INDEX IF NOT EXISTS snapshots_cluster_run ON snapshots ( cluster, run )" )
+    db.execute( "CREATE TABLE IF NOT EXISTS registrations ( cluster TEXT, {} )".format( ', '.join( REGISTRATION_COLUMNS ) ) )
+    return db
+
+def save_snapshot( config, records ):
+    run = time.time()
+    with _status_db() as db:
+        db.executemany(
+            "INSERT INTO snapshots VALUES ( ?, ?, {} )".format( ', '.join( '?' for _ in SNAPSHOT_COLUMNS ) ),
+            [ [ run, config.cluster ] + [ record[ column ] for column in SNAPSHOT_COLUMNS ] for record in records ]
+        )
+    db.close()
+
+def load_last_snapshot( config ) -> tuple:
+    """ Returns ( run time, records ) for the most recent status run of this cluster. """
+    db = _status_db()
+    last = db.execute( "SELECT MAX( run ) FROM snapshots WHERE cluster = ?", ( config.cluster, ) ).fetchone()[0]
+    records = [ dict( row ) for row in db.execute( "SELECT * FROM snapshots WHERE cluster = ? AND run = ?", ( config.cluster, last ) ) ]
+    db.close()
+    return last, records
+
+def load_snapshots_since( config, seconds: float ) -> list:
+    db = _status_db()
+    records = [ dict( row ) for row in db.execute( "SELECT * FROM snapshots WHERE cluster = ? AND run >= ? ORDER BY run", ( config.cluster, time.time() - seconds ) ) ]
+    db.close()
+    return records
+
+# Where register.py on a host writes its progress lines, and how often marius logs them while waiting.
+REGISTER_PROGRESS = '~/.marius/register.jsonl'
+PROGRESS_INTERVAL = 60
+# Seconds to wait for a stopped register.py to join its workers and write its final line.
+REGISTER_EXIT_TIMEOUT = 15
+
+def registration_progress( config, connection, wait: bool = False ) -> dict:
+    """ The latest progress line of the host's registration run or None. With wait, register.py is first given
+        REGISTER_EXIT_TIMEOUT seconds to exit so the line is its final one.
+    """
+    progress_command = 'tail -n 1 {}'.format( REGISTER_PROGRESS )
+    if wait:
+        # The brackets keep the pattern from matching the shell running pgrep.
+        progress_command = "for i in $( seq {} ); do pgrep -f 'python3 [r]egister.py' > /dev/null || break; sleep 0.2; done; {}".format( REGISTER_EXIT_TIMEOUT * 5, progress_command )
+    progress_result = connection.run( progress_command, warn = True, hide = True )
+    try: return json.loads( progress_result.stdout )
+    except ValueError: return None
+
+def record_registration( config, connection, droplet, hotkey: str, registered: bool ):
+    """ Stores the host's last registration run for hotkey, registered tells whether the hotkey ended up registered.
+        Called after the run was stopped, it waits for register.py to write its final line. copy_registration_tools
+        removes the previous run's progress, so a run which never started is not recorded again.
+    """
+    progress = registration_progress( config, connection, wait = True )
+    if progress == None: logger.warning('<blue>{}</blue>: No registration progress to record', droplet.name); return
+    if progress['state'] == 'already_registered': logger.debug('<blue>{}</blue>: Already registered, no run to record', droplet.name); return
+    record = {
+        'started': progress['time'] - progress['elapsed'],
+        'name': droplet.name,
+        'slug': getattr( droplet, 'size_slug', None ),
+        'hotkey': hotkey,
+        'procs': progress['procs'],
+        'duration': progress['elapsed'],
+        'hashes': progress['hashes'],
+        'hashrate': progress['hashes'] / max( progress['elapsed'], 1e-6 ),
+        'difficulty': progress['difficulty'],
+        'state': progress['state'],
+        'registered': registered,
+    }
+    with _status_db() as db:
+        db.execute( "INSERT INTO registrations VALUES ( ?, {} )".format( ', '.join( '?' for _ in REGISTRATION_COLUMNS ) ), [ config.cluster ] + [ record[ column ] for column in REGISTRATION_COLUMNS ] )
+    db.close()
+
+def load_registrations( config, seconds: float = None ) -> list:
+    db = _status_db()
+    since = time.time() - seconds if seconds != None else 0
+    records = [ dict( row ) for row in db.execute( "SELECT * FROM registrations WHERE cluster = ? AND started >= ? ORDER BY started", ( config.cluster, since ) ) ]
+    db.close()
+    return records
+
+def parse_duration( duration: str ) -> float:
+    """ Parses durations like 90s, 30m, 24h or 7d into seconds. """
+    units = { 's': 1, 'm': 60, 'h': 60 * 60, 'd': 24 * 60 * 60 }
+    if duration[-1] in units:
+        return float( duration[:-1] ) * units[ duration[-1] ]
+    return float( duration )
+
 def copy_script( config, connection, script_path ):
     rm_script_command = "rm ~/main.py"
     logger.debug("rm script: {}", rm_script_command)
@@ -336,6 +1535,49 @@ def is_script_running( config, connection ) -> bool:
     else:
         return False
 
+# Collects every fact shown by `marius status` in a single remote exec and prints them as one json document.
+# The checks mirror get_hotkey, get_coldkeypub, get_branch, is_installed and is_script_running.
+PROBE_SCRIPT = """
+import json, os, subprocess
+def ss58( path ):
+    try:
+        with open( os.path.expanduser( path ), 'r' ) as f:
+            return json.load( f )['ss58Address']
+    except Exception:
+        return None
+def run( command ):
+    return subprocess.run( command, shell = True, stdout = subprocess.PIPE, stderr = subprocess.DEVNULL, universal_newlines = True )
+facts = { 'connected': True, 'branch': None, 'installed': False, 'running': False }
+facts['hotkey'] = ss58( '~/.bittensor/wallets/default/hotkeys/default' )
+facts['coldkeypub'] = ss58( '~/.bittensor/wallets/default/coldkeypub.txt' )
+branch = run( 'cd ~/.bittensor/bittensor ; git branch --show-current' )
+if branch.returncode == 0:
+    facts['branch'] = branch.stdout.strip()
+if facts['branch'] != None:
+    facts['installed'] = run( 'python3 -c \"import bittensor\"' ).returncode == 0
+if facts['installed']:
+    facts['running'] = len( run( 'pm2 pid script' ).stdout ) > 1
+print( json.dumps( facts ) )
+"""
+
+PROBE_COMMAND = "python3 -c {}".format( shlex.quote( PROBE_SCRIPT ) )
+
+def parse_probe( stdout: str ) -> dict:
+    try:
+        return json.loads( stdout.strip().splitlines()[-1] )
+    except Exception:
+        return { 'connected': True }
+
+def probe_machine( config, connection ) -> dict:
+    logger.debug("Probing machine: {}", connection.host)
+    try:
+        probe_result = connection.run(PROBE_COMMAND, hide=not config.debug, warn=True)
+    except Exception as e:
+        logger.debug("Failed to probe {}: {}", connection.host, e)
+        return { 'connected': False }
+    logger.debug(probe_result)
+    return parse_probe( probe_result.stdout )
+
 def copy_script( config, connection, script_path ):
     rm_script_command = "rm ~/main.py"
     logger.debug("rm script: {}", rm_script_command)
@@ -355,9 +1597,9 @@ def get_script( config, connection, script ) -> str:
     return cat_script_result.stdout
 
 def start_subtensor( config, connection, ):
-    subtensor_command = "sudo apt-get update && sudo apt install docker.io -y && rm /usr/bin/docker-compose || true && curl -L https://github.com/docker/compose/releases/download/1.29.2/docker-compose-Linux-x86_64 -o /usr/local/bin/docker-compose && sudo chmod +x /usr/local/bin/docker-compose && sudo ln -s /usr/local/bin/docker-compose /usr/bin/docker-compose  && rm -rf subtensor || true && git clone https://github.com/opentensor/subtensor.git && cd subtensor && docker-compose up -d"
+    subtensor_command = "rm /usr/bin/docker-compose || true && curl -L https://github.com/docker/compose/releases/download/1.29.2/docker-compose-Linux-x86_64 -o /usr/local/bin/docker-compose && sudo chmod +x /usr/local/bin/docker-compose && sudo ln -s /usr/local/bin/docker-compose /usr/bin/docker-compose  && rm -rf subtensor || true && git clone https://github.com/opentensor/subtensor.git && cd subtensor && docker-compose up -d"
     logger.debug("Starting subtensor: {}", subtensor_command)
-    subtensor_result = connection.run(subtensor_command, warn=True, hide=not config.debug, pty=False)
+    subtensor_result = run_step(config, connection, 'subtensor', subtensor_command, "docker ps --format '{{.Names}}' | grep subtensor", warn=True, hide=not config.debug, pty=False)
     logger.debug( subtensor_result )
     return subtensor_result
 
@@ -365,7 +1607,7 @@ def start_script( config, connection, name, args ):
     args = args.replace("$NAME", name)
     start_script_command = "pm2 start ~/main.py --name script --time --interpreter python3 -- {}".format( args )
     logger.debug("Starting script: {}", start_script_command)
-    start_script_result = connection.run(start_script_command, warn=True, hide=not config.debug, pty=False)
+    start_script_result = connection.run(start_script_command, warn=True, hide=not config.debug, pty=False, idempotent=False)
     logger.debug( start_script_result )
     return start_script_result
 
@@ -391,19 +1633,24 @@ def start_command( config, connection, name, command ):
 
     start_script_command = "pm2 start {} --name script --time --interpreter python3 -- {}".format( command, args_string )
     logger.debug("Starting script: {}", start_script_command)
-    start_script_result = connection.run(start_script_command, warn=True, hide=not config.debug, pty=False)
+    start_script_result = connection.run(start_script_command, warn=True, hide=not config.debug, pty=False, idempotent=False)
     logger.debug( start_script_result )
     return start_script_result
 
+STOP_SCRIPT_COMMAND = "pm2 delete script"
+
 def stop_script( config, connection ):
-    stop_script_command = "pm2 delete script"
+    stop_script_command = STOP_SCRIPT_COMMAND
     logger.debug("Stopping script: {}", stop_script_command)
     stop_script_result = connection.run(stop_script_command, warn=True, hide=not config.debug)
     logger.debug( stop_script_result )
     return stop_script_result
 
+def get_logs_command( config ) -> str:
+    return "pm2 logs script --lines {} --nostream --raw".format( config.lines )
+
 def get_logs( config, connection ): 
-    logs_command = "pm2 logs script --lines {} --nostream --raw".format( config.lines )
+    logs_command = get_logs_command( config )
     logger.debug("Running logs: {}", logs_command)
     logs_command = connection.run(logs_command, warn=True, hide = not config.debug)
     if logs_command.failed:
@@ -411,10 +1658,11 @@ def get_logs( config, connection ):
     return logs_command.stdout
 
 def copy_registration_tools( config, connection ):
-    rm_script_command = "rm check.py && rm fast_register.sh && chmod +x ~/.bittensor/bittensor/bin/btcli"
+    # The previous run's progress goes too, so record_registration never records it twice.
+    rm_script_command = "rm -f check.py register.py fast_register.sh {} && chmod +x ~/.bittensor/bittensor/bin/btcli".format( REGISTER_PROGRESS )
     rm_script_result = connection.run(rm_script_command, warn=True, hide=not config.debug)
     transfer_object = fabric.transfer.Transfer( connection )
-    copy_script1_result = transfer_object.put(  "check.py" , "check.py", preserve_mode = True )
+    copy_script1_result = transfer_object.put(  "register.py" , "register.py", preserve_mode = True )
     copy_script2_result = transfer_object.put(  "fast_register.sh" , "fast_register.sh", preserve_mode = True )
     logger.debug(copy_script1_result)
     logger.debug(copy_script2_result)
@@ -424,38 +1672,58 @@ def copy_registration_tools( config, connection ):
     return True
 
 def run_registration_tools( config, connection ):
-    run_registration = "./fast_register.sh ~/.bittensor/bittensor/bin/btcli fast fast {}".format( config.procs )
-    run_registration_result = connection.run(run_registration, warn=False, hide=False, disown = True, timeout = 60 * 60 * 60)
+    run_registration = "./fast_register.sh ~/.bittensor/bittensor/bin/btcli fast fast {} {}".format( config.procs, config.timeout )
+    run_registration_result = connection.run(run_registration, warn=False, hide=False, disown = True, timeout = 60 * 60 * 60, idempotent = False)
     logger.debug(run_registration_result)
     return run_registration_result
 
 def run_registration_tools_default( config, connection ):
-    run_registration = "./fast_register.sh ~/.bittensor/bittensor/bin/btcli default default {}".format( config.procs )
-    run_registration_result = connection.run(run_registration, warn=True, hide=False, timeout = config.timeout )
+    # register.py gives up by itself at config.timeout and writes its final line, the ssh timeout is only a backstop.
+    run_registration = "./fast_register.sh ~/.bittensor/bittensor/bin/btcli default default {} {}".format( config.procs, config.timeout )
+    run_registration_result = connection.run(run_registration, warn=True, hide=False, timeout = config.timeout + REGISTER_EXIT_TIMEOUT, idempotent = False )
     logger.debug(run_registration_result)
     return run_registration_result
 
+def start_registration( config, connection ) -> bool:
+    """ Starts registering the host's default wallet in the background unless it already is. register.py exits by
+        itself once the hotkey is registered. Returns whether a registration was started.
+    """
+    # The brackets keep the pattern from matching the shell running pgrep.
+    if connection.run( "pgrep -f 'python3 [r]egister.py'", warn = True, hide = True ).ok: return False
+    copy_registration_tools( config, connection )
+    run_registration = "nohup ./fast_register.sh ~/.bittensor/bittensor/bin/btcli default default {} > /dev/null 2>&1 &".format( config.procs )
+    logger.debug("Starting registration: {}", run_registration)
+    run_registration_result = connection.run( run_registration, warn = True, hide = not config.debug, pty = False, idempotent = False )
+    logger.debug(run_registration_result)
+    return run_registration_result.ok
+
 def kill_fast_register( config, connection ):
-    kill_registration_result = connection.run('pkill -f fast_register', warn=True, hide=False )
-    kill_registration_result = connection.run('pkill -f register', warn=True, hide=False )
+    kill_registration_result = connection.run('pkill -f fast_register', warn=True, hide=False, idempotent=False )
+    kill_registration_result = connection.run('pkill -f register', warn=True, hide=False, idempotent=False )
     logger.debug(kill_registration_result)
     return kill_registration_result
 
 def run_registration_tools_old( config, connection ):
     run_registration = "python3 ~/.bittensor/bittensor/bin/btcli register --wallet.name fast --wallet.hotkey fast --no_prompt"
-    run_registration_result = connection.run(run_registration, warn=True, hide=False, timeout = config.timeout )
+    run_registration_result = connection.run(run_registration, warn=True, hide=False, timeout = config.timeout, idempotent = False )
     logger.info(run_registration_result)
     return run_registration_result
 
+CLEAR_CACHE_COMMAND = "rm -rf ~/.bittensor/miners && rm -rf /root/.pm2/logs/"
+
 def clear_cache( config, connection ):
-    run_clear = "rm -rf ~/.bittensor/miners && rm -rf /root/.pm2/logs/"
+    run_clear = CLEAR_CACHE_COMMAND
     run_clear_result = connection.run(run_clear, warn=True, hide=not config.debug)
     logger.info(run_clear_result)
     return run_clear_result
 
+REBOOT_COMMAND = "sudo shutdown -r now -f"
+# Steps of marius reboot, for run_commands_on_machines.
+REBOOT_STEPS = [ ( 'stop miner', STOP_SCRIPT_COMMAND, False ), ( 'clear cache', CLEAR_CACHE_COMMAND, True ), ( 'reboot', REBOOT_COMMAND, True ) ]
+
 def run_reboot( config, connection ):
-    run_reboot = "sudo shutdown -r now -f"
-    run_reboot_result = connection.run(run_reboot, warn=True, hide=not config.debug)
+    run_reboot = REBOOT_COMMAND
+    run_reboot_result = connection.run(run_reboot, warn=True, hide=not config.debug, idempotent=False)
     logger.info(run_reboot_result)
     return run_reboot_result
 
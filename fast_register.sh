@@ -1,26 +1,14 @@
 #!/bin/bash
-#      ^^^^ - NOT /bin/sh, as this code uses arrays
-
-pids=( )
-
-# define cleanup function
-cleanup() {
-  for pid in "${pids[@]}"; do
-    kill -0 "$pid" && kill "$pid" # kill process only if it's still running
-  done
-}
-
-# and set that function to run before we exit, or specifically when we get a SIGTERM
-trap cleanup EXIT TERM
+# Usage: ./fast_register.sh <btcli> <coldkey> <hotkey> <procs> [<timeout>]
+# register.py imports bittensor once, hashes on <procs> forked workers (-1 for one per core) sharing the current block
+# and difficulty, checks the chain once per block and stops every worker as soon as the hotkey is registered.
+# With <timeout> register.py gives up after that many seconds and records the run as timed out.
+# <btcli> is no longer used and only kept so existing invocations keep working.
 
 echo "Script: $1";
 echo "Coldkey: $2";
 echo "Hotkey: $3";
 echo "NProcs: $4";
+echo "Timeout: ${5:-none}";
 
-python3 check.py $2 $3 & pids+=( "$!" )
-for i in $(seq $4); do
-    python3 $1 register --no_prompt --wallet.name $2 --wallet.hotkey $3 & pids+=( "$!" )
-done
-
-wait # sleep until all background processes have exited, or a trap fires
\ No newline at end of file
+exec python3 register.py $2 $3 --procs $4 ${5:+--timeout $5}
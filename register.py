@@ -0,0 +1,193 @@
+import os
+import sys
+import json
+import time
+import queue
+import ctypes
+import signal
+import random
+import hashlib
+import argparse
+import multiprocessing
+import bittensor
+
+# Registration proof of work: find a nonce whose seal sha256( nonce as 8 little endian bytes + block hash bytes )
+# times the difficulty does not overflow 256 bits, i.e. is at most 2^256 - 1, for one of the last few blocks.
+LIMIT = 2 ** 256 - 1
+# Nonces a worker tries before it looks at the shared block state and the stop flag again.
+BATCH = 50000
+# One json line per block and a final one for the run, read back by marius.
+PROGRESS_FILE = os.path.expanduser( '~/.marius/register.jsonl' )
+
+class BlockState( ctypes.Structure ):
+    """ The block being solved, shared with the workers. """
+    _fields_ = [ ( 'block_number', ctypes.c_uint64 ), ( 'difficulty', ctypes.c_uint64 ), ( 'block_hash', ctypes.c_char * 66 ) ]
+
+def seal( nonce: int, block_bytes: bytes ) -> bytes:
+    return hashlib.sha256( nonce.to_bytes( 8, 'little' ) + block_bytes ).digest()
+
+def solve( index: int, state, solutions, stop, hashes ):
+    """ Proof of work worker, forked from the supervisor so bittensor is never imported again. """
+    nonce = random.randrange( 2 ** 64 )
+    solved = None
+    while not stop.is_set():
+        with state.get_lock():
+            block_number, difficulty, block_hash = state.block_number, state.difficulty, state.block_hash.decode()
+        # One solution per block is enough, wait for the next one.
+        if block_number == 0 or block_number == solved: time.sleep( 0.1 ); continue
+        block_bytes = bytes.fromhex( block_hash[2:] )
+        # seal * difficulty <= LIMIT holds exactly when the big endian seal is at most target.
+        target = ( LIMIT // difficulty ).to_bytes( 32, 'big' )
+        if nonce + BATCH >= 2 ** 64: nonce = 0
+        start = nonce
+        for nonce in range( start, start + BATCH ):
+            work = seal( nonce, block_bytes )
+            if work <= target:
+                solutions.put( ( block_number, nonce, work ) )
+                solved = block_number
+                break
+        nonce += 1
+        with hashes.get_lock(): hashes.value += nonce - start
+
+class Progress:
+    """ Reports hashrate, difficulty and the expected time to solve to stdout and PROGRESS_FILE. A seal meets the
+        difficulty with probability about 1 / difficulty, so a solve is expected after difficulty / hashrate seconds.
+    """
+    def __init__( self, args, procs: int, hashes ):
+        self.args = args
+        self.procs = procs
+        self.hashes = hashes
+        self.start = time.time()
+        self.last = ( self.start, 0 )
+        os.makedirs( os.path.dirname( PROGRESS_FILE ), exist_ok = True )
+        open( PROGRESS_FILE, 'w' ).close()
+
+    def report( self, state: str, block: int = None, difficulty: int = None ):
+        now, hashes = time.time(), self.hashes.value
+        hashrate = ( hashes - self.last[1] ) / max( now - self.last[0], 1e-6 )
+        self.last = ( now, hashes )
+        line = json.dumps( {
+            'time': now,
+            'state': state,
+            'coldkey': self.args.coldkey,
+            'hotkey': self.args.hotkey,
+            'procs': self.procs,
+            'block': block,
+            'difficulty': difficulty,
+            'hashes': hashes,
+            'hashrate': hashrate,
+            'eta': difficulty / hashrate if difficulty and hashrate > 0 else None,
+            'elapsed': now - self.start,
+        } )
+        print( line )
+        with open( PROGRESS_FILE, 'a' ) as f: f.write( line + '\n' )
+
+def submit( subtensor, wallet, block_number: int, nonce: int, work: bytes ) -> bool:
+    with subtensor.substrate as substrate:
+        call = substrate.compose_call(
+            call_module = 'SubtensorModule',
+            call_function = 'register',
+            call_params = {
+                'block_number': block_number,
+                'nonce': nonce,
+                'work': [ int( byte ) for byte in work ],
+                'hotkey': wallet.hotkey.ss58_address,
+                'coldkey': wallet.coldkeypub.ss58_address
+            }
+        )
+        extrinsic = substrate.create_signed_extrinsic( call = call, keypair = wallet.hotkey )
+        response = substrate.submit_extrinsic( extrinsic, wait_for_inclusion = True )
+        response.process_events()
+        if not response.is_success: print( 'Submission failed: {}'.format( response.error_message ) )
+        return response.is_success
+
+def main():
+    parser = argparse.ArgumentParser( description = 'Registers a hotkey with a proof of work pool sized to this machine.' )
+    parser.add_argument( 'coldkey', type = str, help = 'Wallet name' )
+    parser.add_argument( 'hotkey', type = str, help = 'Hotkey name' )
+    parser.add_argument( '--procs', type = int, default = -1, help = 'Proof of work processes, -1 for one per core.' )
+    parser.add_argument( '--timeout', type = float, default = None, help = 'Seconds to give up after.' )
+    args = parser.parse_args()
+
+    # Stopped with SIGTERM by marius or fast_register.sh, unwind so the workers are stopped too.
+    signal.signal( signal.SIGTERM, lambda signum, frame: sys.exit( 1 ) )
+    subtensor = bittensor.subtensor()
+    wallet = bittensor.wallet( name = args.coldkey, hotkey = args.hotkey )
+    hashes = multiprocessing.Value( 'Q', 0 )
+    procs = os.cpu_count() if args.procs <= 0 else args.procs
+    progress = Progress( args, procs, hashes )
+    if not subtensor.neuron_for_pubkey( wallet.hotkey.ss58_address ).is_null:
+        print( 'DONE' )
+        print( 'Already registered' )
+        # Nothing was hashed, marius does not record the run.
+        progress.report( 'already_registered' )
+        return 0
+
+    state = multiprocessing.Value( BlockState, lock = True )
+    solutions = multiprocessing.Queue()
+    stop = multiprocessing.Event()
+    workers = [ multiprocessing.Process( target = solve, args = ( i, state, solutions, stop, hashes ), daemon = True ) for i in range( procs ) ]
+
+    start = time.time()
+    attempts = 0
+    last_block = None
+    difficulty = None
+    outcome = 'stopped'
+    try:
+        for worker in workers: worker.start()
+        while args.timeout == None or time.time() - start < args.timeout:
+            # A failed chain call only costs this block, the workers keep solving the last one meanwhile.
+            try:
+                block = subtensor.get_current_block()
+                if block != last_block:
+                    attempts += 1
+                    if not subtensor.neuron_for_pubkey( wallet.hotkey.ss58_address ).is_null:
+                        outcome = 'registered'
+                        print( 'DONE' )
+                        print( 'Registered at block {} after {:.1f}s and {} checks'.format( block, time.time() - start, attempts ) )
+                        return 0
+                    difficulty = subtensor.difficulty
+                    block_hash = subtensor.substrate.get_block_hash( block )
+                    with state.get_lock():
+                        state.block_number, state.difficulty, state.block_hash = block, difficulty, block_hash.encode()
+                    last_block = block
+                    progress.report( 'running', block, difficulty )
+            except Exception as e:
+                print( 'Failed to update block {}: {}'.format( last_block, e ) )
+                time.sleep( 1 )
+                continue
+
+            try: block_number, nonce, work = solutions.get( timeout = 1 )
+            except queue.Empty: continue
+            try:
+                # Stale solutions are rejected by the chain.
+                if block_number < subtensor.get_current_block() - 3: continue
+                print( 'Found solution for block {}, submitting'.format( block_number ) )
+                registered = submit( subtensor, wallet, block_number, nonce, work )
+            except Exception as e:
+                print( 'Submission failed: {}'.format( e ) )
+                continue
+            if registered:
+                outcome = 'registered'
+                print( 'DONE' )
+                print( 'Registered at block {} after {:.1f}s and {} checks'.format( block_number, time.time() - start, attempts ) )
+                return 0
+        outcome = 'timeout'
+        print( 'Timed out after {:.1f}s'.format( time.time() - start ) )
+        return 1
+
+    except KeyboardInterrupt:
+        print( 'STOPPED after {:.1f}s and {} checks'.format( time.time() - start, attempts ) )
+        return 1
+
+    finally:
+        stop.set()
+        for worker in workers:
+            worker.join( timeout = 5 )
+            if worker.is_alive(): worker.terminate()
+        # The final line carries the mean hashrate over the whole run.
+        progress.last = ( progress.start, 0 )
+        progress.report( outcome, last_block, difficulty )
+
+if __name__ == "__main__":
+    sys.exit( main() )
@@ -0,0 +1,150 @@
+import os
+import sys
+import time
+import threading
+import pytest
+from types import SimpleNamespace
+
+sys.path.insert( 0, os.path.dirname( os.path.dirname( os.path.abspath( __file__ ) ) ) )
+paramiko = pytest.importorskip( 'paramiko' )
+utils = pytest.importorskip( 'utils' )
+
+class Config( dict ):
+    """ Attribute access like bittensor.Config. """
+    __getattr__ = dict.__getitem__
+
+@pytest.fixture
+def config( tmp_path ):
+    key_path = str( tmp_path / 'id_rsa' )
+    paramiko.RSAKey.generate( 2048 ).write_private_key_file( key_path )
+    return Config( sshkey = key_path, cluster = 'test' )
+
+class Machine:
+    ip_address = '127.0.0.1'
+
+def test_pooled_connection_builds( config ):
+    connection = utils.connection_for_machine( config, Machine() )
+    assert isinstance( connection, utils.PooledConnection )
+    # Pool bookkeeping lives on the instance, not in the invoke config that fabric copies.
+    for name in [ '_open_lock', '_session', 'deadline' ]:
+        assert name not in connection.config
+    assert utils.connection_for_machine( config, Machine() ) is connection
+    utils.close_all_connections()
+
+@pytest.fixture
+def ssh_server( tmp_path, monkeypatch ):
+    """ An asyncssh server on a free local port which runs commands with the local shell. """
+    asyncssh = pytest.importorskip( 'asyncssh' )
+    import asyncio
+    client_key = asyncssh.generate_private_key( 'ssh-rsa' )
+    client_key.write_private_key( str( tmp_path / 'id_rsa' ) )
+    server_key = asyncssh.generate_private_key( 'ssh-rsa' )
+
+    async def _handle( process ):
+        shell = await asyncio.create_subprocess_shell( process.command, stdout = asyncio.subprocess.PIPE )
+        stdout, _ = await shell.communicate()
+        process.stdout.write( stdout.decode() )
+        process.exit( shell.returncode )
+
+    async def _listen():
+        return await asyncssh.listen( '127.0.0.1', 0, server_host_keys = [ server_key ], authorized_client_keys = asyncssh.import_authorized_keys( client_key.export_public_key().decode() ), process_factory = _handle )
+
+    loop = asyncio.new_event_loop()
+    threading.Thread( target = loop.run_forever, daemon = True ).start()
+    server = asyncio.run_coroutine_threadsafe( _listen(), loop ).result()
+    monkeypatch.setattr( utils, 'SSH_PORT', server.sockets[0].getsockname()[1] )
+    yield Config( sshkey = str( tmp_path / 'id_rsa' ), cluster = 'test', max_inflight = 2 )
+    server.close()
+    loop.call_soon_threadsafe( loop.stop )
+
+class Droplet:
+    ip_address = '127.0.0.1'
+    def __init__( self, name ):
+        self.name = name
+
+def test_run_commands_on_machines( ssh_server ):
+    droplets = [ Droplet( 'droplet-{}'.format( i ) ) for i in range( 5 ) ]
+    steps = lambda droplet: [ ( 'echo', 'echo {}'.format( droplet.name ), True ), ( 'fail', 'exit 3', True ), ( 'after', 'true', True ) ]
+    seen = []
+    results = utils.run_commands_on_machines( ssh_server, droplets, steps, on_result = lambda droplet, result: seen.append( droplet.name ), progress = False )
+    assert sorted( seen ) == sorted( droplet.name for droplet in droplets )
+    for droplet, result in zip( droplets, results ):
+        assert result['echo'].ok and result['echo'].stdout.strip() == droplet.name
+        assert result['fail'].failed and result['fail'].exited == 3
+        # A failed required step stops the host.
+        assert 'after' not in result
+
+def test_run_commands_output_is_bounded( ssh_server ):
+    result = utils.run_commands_on_machines( ssh_server, [ Droplet( 'big' ) ], [ ( 'big', 'head -c 1000000 /dev/zero | tr "\\0" x', True ) ], progress = False )[0]
+    assert result['big'].ok and len( result['big'].stdout ) == utils.OUTPUT_LIMIT
+
+def test_run_commands_unreachable( ssh_server, monkeypatch ):
+    monkeypatch.setattr( utils, 'RETRY_ATTEMPTS', 1 )
+    droplet = Droplet( 'unreachable' )
+    droplet.ip_address = '127.0.0.2'
+    monkeypatch.setattr( utils, 'SSH_PORT', 1 )
+    assert utils.run_commands_on_machines( ssh_server, [ droplet ], [ ( 'true', 'true', True ) ], progress = False ) == [ None ]
+
+def test_deadline_per_thread( ssh_server ):
+    connection = utils.PooledConnection( '127.0.0.1', port = utils.SSH_PORT, user = 'root', connect_kwargs = { 'pkey': utils.load_private_key( ssh_server.sshkey ), 'look_for_keys': False } )
+    connection.deadline = time.time() + 1
+    other = []
+    thread = threading.Thread( target = lambda: other.append( connection.deadline ) )
+    thread.start()
+    thread.join()
+    assert other == [ None ]
+    # A command with its own timeout does not use up the host budget.
+    assert connection.run( 'sleep 1.5', hide = True, in_stream = False, timeout = 10 ).ok
+    assert connection.run( 'true', hide = True, in_stream = False ).ok
+    connection.deadline = time.time() - 1
+    with pytest.raises( utils.HostUnavailable ):
+        connection.run( 'true', hide = True, in_stream = False )
+    utils.BREAKER.record_success( '127.0.0.1' )
+    connection.discard()
+
+class Host:
+    user = 'root'
+    def __init__( self, host ):
+        self.host = host
+    def run( self, command, **kwargs ):
+        pass
+
+@pytest.mark.parametrize( 'source_ok', [ True, False ] )
+def test_push_wheelhouse_fallback( tmp_path, monkeypatch, source_ok ):
+    source, target = Host( 'source' ), Host( 'target' )
+    fan_out = utils.fanout_for( str( tmp_path ), 1 )
+    fan_out.seeds.append( source )
+    fan_out.active[ ( source.host, source.user ) ] = 0
+    pushed = []
+    def _fallback_push( connection, *args, **kwargs ):
+        # The fallback holds a controller slot while it pushes.
+        assert fan_out.active[ None ] == 1
+        pushed.append( connection.host )
+    monkeypatch.setattr( utils, 'relay_artifact', lambda config, source, connection, remote: SimpleNamespace( failed = True ) )
+    monkeypatch.setattr( utils, 'verify_artifact', lambda config, connection, directory, remote: connection is target or source_ok )
+    monkeypatch.setattr( utils, 'rsync', _fallback_push )
+    utils.push_wheelhouse( Config( debug = False, fanout = 1, sshkey = 'id_rsa' ), target, str( tmp_path ) )
+    assert pushed == [ 'target' ]
+    assert fan_out.active[ None ] == 0 and fan_out.active[ ( source.host, source.user ) ] == 0
+    # The source only stops serving when its own copy is bad, a failure on the target's side is not held against it.
+    assert ( source in fan_out.seeds ) == source_ok
+    assert target in fan_out.seeds
+
+def test_scheduler_release_requeues_hotkey():
+    scheduler = utils.RegistrationScheduler( [ 'a', 'b', 'c' ], workers = 1 )
+    scheduler.push( 'first', 0 )
+    scheduler.push( 'second', 1 )
+    assert scheduler.assign() == [ ( 'first', 'a' ), ( 'second', 'b' ) ]
+    scheduler.release( 'first', 'a' )
+    assert 'a' not in scheduler.hosts and 'first' not in scheduler.assigned
+    # The hotkey goes back in the queue and gets the next free host.
+    assert scheduler.assign() == [ ( 'first', 'c' ) ]
+    assert scheduler.complete( 'first' ) == [ 'c' ]
+    assert scheduler.pending() == 1
+
+def test_ssh_ready_authenticates( ssh_server, tmp_path ):
+    assert utils.ssh_ready( ssh_server, '127.0.0.1' )
+    # A daemon which does not accept the key yet is not ready.
+    other = str( tmp_path / 'other_rsa' )
+    paramiko.RSAKey.generate( 2048 ).write_private_key_file( other )
+    assert not utils.ssh_ready( Config( sshkey = other ), '127.0.0.1' )